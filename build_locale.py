@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# build_locale.py
+# Генерирует locale_gen.py из словаря LOCALE в tg_app.py: функция t_fast с
+# match/case по литеральным строкам (3.10+ компилирует это в hash-dispatch,
+# на 3.12 быстрее обычного dict-lookup'а). Запускать после правки локалей:
+#   python build_locale.py
+
+import ast
+import io
+import os
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tg_app.py")
+OUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "locale_gen.py")
+
+
+def extract_locale(path):
+    tree = ast.parse(open(path, encoding="utf-8").read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign):
+            for tgt in node.targets:
+                if isinstance(tgt, ast.Name) and tgt.id == "LOCALE" and isinstance(node.value, ast.Dict):
+                    return ast.literal_eval(node.value)
+    raise SystemExit("LOCALE dict literal not found in tg_app.py")
+
+
+def build_flat(locale):
+    # те же fallback'и, что и в tg_app._build_locale_flat
+    keys = set()
+    for d in locale.values():
+        keys.update(d.keys())
+    flat = {}
+    for lang in locale:
+        for key in sorted(keys):
+            s = locale[lang].get(key) or locale["ru"].get(key) or locale["en"].get(key)
+            if s is None:
+                s = key.replace("_", " ").strip().capitalize()
+            flat.setdefault(lang, {})[key] = s
+    return flat
+
+
+def main():
+    locale = extract_locale(SRC)
+    flat = build_flat(locale)
+    buf = io.StringIO()
+    buf.write("# -*- coding: utf-8 -*-\n")
+    buf.write("# СГЕНЕРИРОВАНО build_locale.py — НЕ ПРАВИТЬ РУКАМИ.\n")
+    buf.write("# Источник: словарь LOCALE в tg_app.py.\n\n\n")
+    buf.write("def t_fast(lang, key):\n")
+    buf.write("    match lang:\n")
+    for lang in flat:
+        buf.write(f"        case {lang!r}:\n")
+        buf.write("            match key:\n")
+        for key, s in flat[lang].items():
+            buf.write(f"                case {key!r}:\n")
+            buf.write(f"                    return {s!r}\n")
+    buf.write("    return None\n")
+    with open(OUT, "w", encoding="utf-8", newline="\n") as f:
+        f.write(buf.getvalue())
+    n = sum(len(v) for v in flat.values())
+    print(f"locale_gen.py: {len(flat)} languages, {n} entries")
+
+    # опционально: упакованная локаль для mmap-загрузки в tg_app
+    try:
+        import msgpack
+    except ImportError:
+        print("msgpack not installed — skipping locale.msgpack")
+        return
+    pack = os.path.join(os.path.dirname(OUT), "locale.msgpack")
+    with open(pack, "wb") as f:
+        f.write(msgpack.packb(locale, use_bin_type=True))
+    print(f"locale.msgpack: {os.path.getsize(pack)} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,58 @@
-import time, json, hmac, hashlib, logging
+import time, json, hmac, hashlib, logging, asyncio, threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# httpx gives HTTP/2 multiplexing (many in-flight requests on one TLS
+# connection) for the public market-data endpoints; optional
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# optional compiled signer (Cython/C wrapper over OpenSSL's HMAC): expected
+# signature fast_sign(key: bytes, msg: bytes) -> str (hex). hmac.digest is
+# already a single-shot OpenSSL call, so this only matters at very high
+# order rates — hence just a drop-in hook, not a hard dependency
+try:
+    from _fastsign import fast_sign as _fast_sign
+except ImportError:
+    _fast_sign = None
+
+
+def _json(r):
+    """Разбор тела ответа: orjson по сырым байтам вместо r.json().
+    Возвращает None, если тело не JSON."""
+    try:
+        if orjson is not None:
+            return orjson.loads(r.content)
+        return r.json()
+    except (ValueError, TypeError):
+        return None
 
 logger = logging.getLogger("client")
 
+# Signing throughput depends on OpenSSL dispatching SHA-256 to the CPU's
+# SHA-NI / ARMv8 crypto extensions. Surface the backend once so a slow
+# portable fallback build is visible in the logs. _sign stays on
+# hmac.digest so the single-shot OpenSSL path is always hit.
+assert "sha256" in hashlib.algorithms_guaranteed
+try:
+    import ssl
+    logger.info("[client] sha256 backend: %s (%s)", hashlib.sha256().name, ssl.OPENSSL_VERSION)
+except Exception:
+    pass
+
 class BybitClient:
     def __init__(self, api_key: str, api_secret: str, testnet: bool = True):
         self.api_key = api_key.strip()
@@ -12,38 +62,106 @@ class BybitClient:
         self.sess = requests.Session()
         self.recv_window = 5000
 
+        # precomputed signing material: secret as bytes plus the constant
+        # api_key+recv_window middle of the signed payload — only ts varies;
+        # recv_window is immutable after init so its str form is cached too
+        self._key = self.api_secret.encode()
+        self._recv_str = str(self.recv_window)
+        self._sig_prefix = (self.api_key + self._recv_str).encode()
+
+        # sized connection pool + retry on transient errors: keeps TCP/TLS warm
+        # across calls instead of paying a handshake per request
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=32,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.2,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=frozenset(["GET", "POST"]),
+            ),
+        )
+        self.sess.mount("https://", adapter)
+        # static auth headers live on the session; per-request we only add ts+sign
+        self.sess.headers.update({
+            "X-BAPI-API-KEY": self.api_key,
+            "X-BAPI-RECV-WINDOW": self._recv_str,
+        })
+
         self.account_mode = None  # "UTA" or "CLASSIC"
+        self._mode_lock = threading.Lock()
+
+        # HTTP/2 client for public endpoints (kline / open-interest)
+        self._http2 = None
+        if httpx is not None:
+            try:
+                self._http2 = httpx.Client(http2=True, base_url=self.base, timeout=10)
+            except ImportError:
+                # h2 extra not installed — plain HTTP/1.1 keep-alive still applies
+                self._http2 = None
+
+        # специализированный билдер заголовков: замыкание над константами
+        # экземпляра — на вызов остаются только локальные чтения, без
+        # attribute lookup'ов на self (класс-версии _sign/_headers служат
+        # документацией и запасным путём)
+        digest = hmac.digest
+        key = self._key
+        prefix = self._sig_prefix
+        fast = _fast_sign
+
+        def _make_headers(body=""):
+            if isinstance(body, str):
+                body = body.encode()
+            ts = str(int(time.time() * 1000))
+            msg = b"".join((ts.encode(), prefix, body))
+            sig = fast(key, msg) if fast is not None else digest(key, msg, "sha256").hex()
+            return {"X-BAPI-TIMESTAMP": ts, "X-BAPI-SIGN": sig}
+
+        self._headers = _make_headers
 
     # -------------------- SIGN --------------------
     def _ts(self):
         return str(int(time.time() * 1000))
 
-    def _sign(self, payload: str):
-        return hmac.new(
-            self.api_secret.encode(),
-            payload.encode(),
-            hashlib.sha256
-        ).hexdigest()
+    def _sign(self, payload: bytes):
+        if _fast_sign is not None:
+            return _fast_sign(self._key, payload)
+        # hmac.digest is a single-shot C path (no HMAC object churn)
+        return hmac.digest(self._key, payload, "sha256").hex()
 
     def _headers(self, body=""):
         ts = self._ts()
-        payload = ts + self.api_key + str(self.recv_window) + body
+        if isinstance(body, str):
+            body = body.encode()
+        # b"".join собирает HMAC-вход за одну аллокацию, без промежуточных
+        # конкатенаций и без str-пайплайна
+        msg = b"".join((ts.encode(), self._sig_prefix, body))
         return {
-            "X-BAPI-API-KEY": self.api_key,
             "X-BAPI-TIMESTAMP": ts,
-            "X-BAPI-RECV-WINDOW": str(self.recv_window),
-            "X-BAPI-SIGN": self._sign(payload)
+            "X-BAPI-SIGN": self._sign(msg)
         }
 
+    # -------------------- SIGNED REQUEST HELPERS --------------------
+    def _signed_get(self, path, params=None):
+        return self.sess.get(self.base + path, params=params,
+                             headers=self._headers(""), timeout=10)
+
+    def _signed_post(self, path, body):
+        body_str = json.dumps(body, separators=(",", ":"))
+        return self.sess.post(self.base + path, json=body,
+                              headers=self._headers(body_str), timeout=10)
+
     # -------------------- MODE DETECT --------------------
     def detect_mode(self):
         """Определяет UTA или Classic через v5 balance."""
-        url = self.base + "/v5/account/wallet-balance"
-        params = {"accountType": "UNIFIED", "coin": "USDT"}
         try:
-            r = self.sess.get(url, params=params, headers=self._headers(""), timeout=10)
-            data = r.json()
-        except:
+            r = self._signed_get("/v5/account/wallet-balance",
+                                 {"accountType": "UNIFIED", "coin": "USDT"})
+            data = _json(r)
+        except requests.RequestException:
+            self.account_mode = "CLASSIC"
+            return
+        if data is None:
             self.account_mode = "CLASSIC"
             return
 
@@ -54,33 +172,86 @@ class BybitClient:
 
         logger.info(f"[client] autodetect account mode = {self.account_mode}")
 
+    def _ensure_mode(self):
+        # double-checked locking: ровно один HTTP-вызов детекции,
+        # даже если несколько потоков стартуют одновременно
+        if self.account_mode is None:
+            with self._mode_lock:
+                if self.account_mode is None:
+                    self.detect_mode()
+
     # -------------------- PUBLIC --------------------
+    def _public_get(self, path, params):
+        if self._http2 is not None:
+            r = self._http2.get(path, params=params)
+        else:
+            r = self.sess.get(self.base + path, params=params, timeout=10)
+        return _json(r)
+
     def fetch_ohlcv(self, symbol, interval="5", limit=200):
-        url = self.base + "/v5/market/kline"
-        r = self.sess.get(url, params={"symbol": symbol, "interval": str(interval), "limit": limit}, timeout=10)
-        try:
-            return r.json()
-        except:
-            return None
+        return self._public_get("/v5/market/kline", {"symbol": symbol, "interval": str(interval), "limit": limit})
 
     def fetch_open_interest(self, symbol, interval="5", limit=200):
-        url = self.base + "/v5/market/open-interest"
-        r = self.sess.get(url, params={"symbol": symbol, "interval": str(interval), "limit": limit}, timeout=10)
+        return self._public_get("/v5/market/open-interest", {"symbol": symbol, "interval": str(interval), "limit": limit})
+
+    def fetch_ohlcv_np(self, symbol, interval="5", limit=200):
+        """Kline как контигуозный float64-массив (N, 6):
+        ts, open, high, low, close, volume — готов для NumPy-индикаторов
+        без пер-строчного Python-парсинга. v5 отдаёт строки новейшими
+        вперёд, поэтому разворачиваем в хронологический порядок."""
+        if np is None:
+            return None
+        data = self.fetch_ohlcv(symbol, interval=interval, limit=limit)
+        if not isinstance(data, dict):
+            return None
+        rows = ((data.get("result") or {}).get("list")) or []
+        if not rows:
+            return None
         try:
-            return r.json()
-        except:
+            arr = np.array([r[:6] for r in rows], dtype=np.float64)
+        except (TypeError, ValueError):
             return None
+        if len(arr) > 1 and arr[0, 0] > arr[-1, 0]:
+            arr = arr[::-1]
+        return arr
+
+    async def afetch_ohlcv(self, symbols, interval="5", limit=200):
+        """Конкурентный вариант: klines для нескольких символов за ~1 RTT."""
+        if httpx is None:
+            return {s: self.fetch_ohlcv(s, interval=interval, limit=limit) for s in symbols}
+        try:
+            client = httpx.AsyncClient(http2=True, base_url=self.base, timeout=10)
+        except ImportError:
+            client = httpx.AsyncClient(base_url=self.base, timeout=10)
+        async with client:
+            async def one(sym):
+                try:
+                    r = await client.get("/v5/market/kline",
+                                         params={"symbol": sym, "interval": str(interval), "limit": limit})
+                    return _json(r)
+                except Exception:
+                    return None
+            results = await asyncio.gather(*(one(s) for s in symbols))
+        return dict(zip(symbols, results))
+
+    def fetch_ohlcv_many(self, symbols, interval="5", limit=200):
+        """Sync-обёртка над afetch_ohlcv для вызова из поллера."""
+        try:
+            return asyncio.run(self.afetch_ohlcv(symbols, interval=interval, limit=limit))
+        except RuntimeError:
+            # уже внутри работающего event loop — последовательный fallback
+            return {s: self.fetch_ohlcv(s, interval=interval, limit=limit) for s in symbols}
 
     # -------------------- BALANCE --------------------
     def get_balance_usdt(self):
-        if self.account_mode is None:
-            self.detect_mode()
+        self._ensure_mode()
 
         if self.account_mode == "UTA":
-            url = self.base + "/v5/account/wallet-balance"
-            params = {"accountType": "UNIFIED", "coin": "USDT"}
-            r = self.sess.get(url, params=params, headers=self._headers(""), timeout=10)
-            data = r.json()
+            r = self._signed_get("/v5/account/wallet-balance",
+                                 {"accountType": "UNIFIED", "coin": "USDT"})
+            data = _json(r)
+            if data is None:
+                return 0.0
             if data.get("retCode") != 0:
                 return data
             lst = (data.get("result") or {}).get("list", [])
@@ -91,22 +262,18 @@ class BybitClient:
 
         # CLASSIC → futures v3 + spot v3
         # Try futures USDT first
-        url = self.base + "/contract/v3/private/account/wallet/balance"
-        r = self.sess.get(url, params={"coin": "USDT"}, headers=self._headers(""), timeout=10)
-        try:
-            data = r.json()
-        except:
+        r = self._signed_get("/contract/v3/private/account/wallet/balance", {"coin": "USDT"})
+        data = _json(r)
+        if data is None:
             return 0.0
 
         if data.get("retCode") == 0:
             return float((data.get("result") or {}).get("walletBalance", 0))
 
         # fallback spot
-        url = self.base + "/spot/v3/private/account"
-        r = self.sess.get(url, headers=self._headers(""), timeout=10)
-        try:
-            data = r.json()
-        except:
+        r = self._signed_get("/spot/v3/private/account")
+        data = _json(r)
+        if data is None:
             return 0.0
 
         if data.get("retCode") == 0:
@@ -117,8 +284,7 @@ class BybitClient:
 
     # -------------------- SPOT ORDER --------------------
     def place_spot_order(self, side, qty, symbol):
-        if self.account_mode is None:
-            self.detect_mode()
+        self._ensure_mode()
 
         if self.account_mode == "UTA":
             body = {
@@ -128,31 +294,29 @@ class BybitClient:
                 "orderType": "Market",
                 "qty": str(qty)
             }
-            body_str = json.dumps(body, separators=(",", ":"))
-            headers = self._headers(body_str)
-            r = self.sess.post(self.base + "/v5/order/create", json=body, headers=headers, timeout=10)
-            return r.json()
+            r = self._signed_post("/v5/order/create", body)
+            return _json(r)
 
         # CLASSIC → SPOT v3
         url = self.base + "/spot/v3/private/order"
+        side_l = side.lower()
         params = {
             "symbol": symbol,
-            "side": side.lower(),
+            "side": side_l,
             "type": "market",
             "qty": str(qty)
         }
-        qs = "&".join(f"{k}={params[k]}" for k in sorted(params))
+        # fixed schema — alphabetical key order is known at code-write time,
+        # no need to sort per call
+        qs = f"qty={qty}&side={side_l}&symbol={symbol}&type=market"
         headers = self._headers(qs)
         r = self.sess.post(url, params=params, headers=headers, timeout=10)
-        try:
-            return r.json()
-        except:
-            return {"retCode": -1, "retMsg": "no json"}
+        j = _json(r)
+        return j if j is not None else {"retCode": -1, "retMsg": "no json"}
 
     # -------------------- FUTURES ORDER --------------------
     def place_futures_order(self, side, qty, symbol, leverage=3, reduce_only=False):
-        if self.account_mode is None:
-            self.detect_mode()
+        self._ensure_mode()
 
         if self.account_mode == "UTA":
             body = {
@@ -163,10 +327,8 @@ class BybitClient:
                 "qty": str(qty),
                 "reduceOnly": bool(reduce_only)
             }
-            b = json.dumps(body, separators=(",", ":"))
-            headers = self._headers(b)
-            r = self.sess.post(self.base + "/v5/order/create", json=body, headers=headers, timeout=10)
-            return r.json()
+            r = self._signed_post("/v5/order/create", body)
+            return _json(r)
  
         # CLASSIC → FUTURES v3
         body = {
@@ -176,10 +338,6 @@ class BybitClient:
             "qty": str(qty),
             "reduceOnly": reduce_only
         }
-        b = json.dumps(body, separators=(",", ":"))
-        headers = self._headers(b)
-        r = self.sess.post(self.base + "/contract/v3/private/order/create", json=body, headers=headers, timeout=10)
-        try:
-            return r.json()
-        except:
-            return {"retCode": -1, "retMsg": "no json"}
+        r = self._signed_post("/contract/v3/private/order/create", body)
+        j = _json(r)
+        return j if j is not None else {"retCode": -1, "retMsg": "no json"}
@@ -6,12 +6,74 @@ try:
 except Exception:
     pass
 
-import os, json, threading, traceback
-from datetime import datetime, timedelta
+import os, json, time, threading, traceback
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+# orjson is much faster for both loads and dumps; fall back to stdlib json if absent
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# pysimdjson parses lazily (only touched fields are materialized) — ideal for
+# read-only scans like get_trades_for_user / is_subscribed; optional dependency
+try:
+    import simdjson
+    _SIMD_PARSER = simdjson.Parser()
+except ImportError:
+    simdjson = None
+    _SIMD_PARSER = None
 
 LOCK = threading.Lock()
 USERS_FILE = os.getenv('USERS_FILE', './users.json')
 TRADES_FILE = os.getenv('TRADES_FILE', './trades.json')
+# append-only журнал сделок: одна JSON-строка на сделку, запись = один write()
+TRADES_NDJSON = os.getenv('TRADES_NDJSON', os.path.splitext(TRADES_FILE)[0] + '.ndjson')
+# шардированное хранилище: users/<uid>.json — точечная запись одного
+# пользователя стоит O(1), а не O(всей базы) как с единым users.json
+USERS_DIR = os.getenv('USERS_DIR', './users')
+
+# in-memory cache of parsed files keyed by path; entries are
+# ((st_mtime_ns, st_size), data) so writes from the other process
+# (trading_core <-> tg_app) invalidate automatically via stat()
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+# счётчик поколений кэша: растёт при каждом (ре)парсинге или записи;
+# позволяет load_users перестраивать индексы только когда что-то менялось
+_CACHE_VERSION = 0
+_IDX_VERSION = -1
+
+# SoA-индексы по users.json: подписка как epoch-секунды и флаг триала.
+# Держатся в актуальном состоянии вместе с кэшем, так что is_subscribed /
+# has_used_trial — это один lookup + одно сравнение float.
+_SUB_IDX = {}    # uid -> epoch seconds (0.0 = нет подписки, inf = forever)
+_TRIAL_IDX = {}  # uid -> used_trial
+
+
+def _rebuild_user_indexes(users):
+    sub, trial = {}, {}
+    for uid, u in users.items():
+        if not isinstance(u, dict):
+            continue
+        until = u.get('sub_until')
+        ts = 0.0
+        if until:
+            try:
+                if isinstance(until, str) and until.lower() == 'forever':
+                    ts = float('inf')
+                else:
+                    # sub_until хранится как naive-UTC isoformat
+                    ts = datetime.fromisoformat(str(until)).replace(tzinfo=timezone.utc).timestamp()
+            except Exception:
+                ts = 0.0
+        sub[uid] = ts
+        s = u.get('settings') or {}
+        trial[uid] = bool(s.get('used_trial', False))
+    _SUB_IDX.clear()
+    _SUB_IDX.update(sub)
+    _TRIAL_IDX.clear()
+    _TRIAL_IDX.update(trial)
 
 # --- Encryption disabled / no-op (we store plain text) ---
 def decrypt(value):
@@ -25,21 +87,69 @@ def _ensure_files():
                 json.dump(default, f, indent=4, ensure_ascii=False)
 
 def _read(path, default):
+    # без os.path.exists: файлы созданы на старте, отсутствие — редкий случай,
+    # который дешевле поймать как FileNotFoundError, чем платить stat за чтение
     try:
-        if not os.path.exists(path):
-            _ensure_files()
-            return default
-        with open(path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(path, 'rb') as f:
+            raw = f.read()
+    except FileNotFoundError:
+        _ensure_files()
+        return default
+    except Exception:
+        traceback.print_exc()
+        return default
+    try:
+        if orjson is not None:
+            return orjson.loads(raw)
+        return json.loads(raw.decode('utf-8'))
     except Exception:
         traceback.print_exc()
         return default
 
+def _read_cached(path, default):
+    try:
+        st = os.stat(path)
+    except OSError:
+        _ensure_files()
+        return default
+    key = (st.st_mtime_ns, st.st_size)
+    with _CACHE_LOCK:
+        ent = _CACHE.get(path)
+        if ent is not None and ent[0] == key:
+            return ent[1]
+    data = _read(path, default)
+    with _CACHE_LOCK:
+        global _CACHE_VERSION
+        _CACHE_VERSION += 1
+        _CACHE[path] = (key, data)
+    return data
+
+def _dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, indent=4, ensure_ascii=False).encode('utf-8')
+
 def _write(path, data):
     try:
         os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+        payload = _dumps(data)
+        # write to a temp file then atomically rename — a crash mid-write can
+        # never leave a truncated users.json/trades.json behind
+        tmp = path + ".tmp"
+        with open(tmp, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        # keep the cache hot: store the freshly written object under the new stat
+        try:
+            st = os.stat(path)
+            with _CACHE_LOCK:
+                global _CACHE_VERSION
+                _CACHE_VERSION += 1
+                _CACHE[path] = ((st.st_mtime_ns, st.st_size), data)
+        except OSError:
+            pass
     except Exception:
         traceback.print_exc()
 
@@ -102,7 +212,7 @@ def set_subscription(uid, days, path=None):
      - если подписка активна -> продлить от даты окончания
     """
     users = load_users(path)
-    users = _ensure_user_defaults(users, uid)
+    users, _ = _ensure_user_defaults(users, uid)
     u = users[str(uid)]
 
     now = datetime.utcnow()
@@ -122,15 +232,35 @@ def set_subscription(uid, days, path=None):
 
     u["sub_until"] = new_dt.isoformat()
     users[str(uid)] = u
-    save_users(users, path)
+    _save_user(uid, users, path)
     return u["sub_until"]
 
 def is_subscribed(uid, path=None):
-    users = load_users(path)
-    u = users.get(str(uid))
-    if not u:
-        return False
-    until = u.get("sub_until")
+    if path is None:
+        # горячий путь: load_users освежает кэш+индексы по mtime,
+        # дальше одна проверка float против текущего времени
+        load_users()
+        return _SUB_IDX.get(str(uid), 0.0) > time.time()
+    until = None
+    users_path = path
+    if _SIMD_PARSER is not None and os.path.exists(users_path):
+        # lazy parse: walk straight to sub_until without materializing other users
+        try:
+            with open(users_path, 'rb') as f:
+                doc = _SIMD_PARSER.parse(f.read())
+            try:
+                until = doc[str(uid)]['sub_until']
+            except KeyError:
+                return False
+        except Exception:
+            traceback.print_exc()
+            until = None
+    if until is None:
+        users = load_users(path)
+        u = users.get(str(uid))
+        if not u:
+            return False
+        until = u.get("sub_until")
     if not until:
         return False
     try:
@@ -144,28 +274,39 @@ def _ensure_user_defaults(users, uid, username=None):
     """
     Merge-only normalization: НЕ перезаписывает существующие поля,
     только добавляет недостающие ключи и значения по умолчанию.
+    Возвращает (users, changed) — callers могут пропустить save, если
+    ничего не добавилось.
     """
     uid = str(uid)
+    changed = False
     if uid not in users:
         users[uid] = {}
+        changed = True
 
     u = users[uid]
 
+    def _setdefault(d, k, v):
+        nonlocal changed
+        if k not in d:
+            d[k] = v
+            changed = True
+
     # basic top-level fields (preserve existing)
-    u.setdefault('username', username or f"user_{uid}")
-    u.setdefault('api_key', '')
-    u.setdefault('api_secret', '')
-    u.setdefault('sub_until', None)
-    u.setdefault('_positions', {})
+    _setdefault(u, 'username', username or f"user_{uid}")
+    _setdefault(u, 'api_key', '')
+    _setdefault(u, 'api_secret', '')
+    _setdefault(u, 'sub_until', None)
+    _setdefault(u, '_positions', {})
 
     # ensure settings dict exists and merge defaults there
     if 'settings' not in u or not isinstance(u['settings'], dict):
         u['settings'] = {}
+        changed = True
 
     s = u['settings']
     # merge DEFAULT_SETTINGS into settings without overwriting existing keys
     for k, v in DEFAULT_SETTINGS.items():
-        s.setdefault(k, v)
+        _setdefault(s, k, v)
 
     # ensure older top-level used_trial (if present) migrates into settings.used_trial
     if 'used_trial' in u and 'used_trial' not in s:
@@ -175,11 +316,12 @@ def _ensure_user_defaults(users, uid, username=None):
             u.pop('used_trial', None)
         except Exception:
             s.setdefault('used_trial', False)
+        changed = True
 
     # write back
     u['settings'] = s
     users[uid] = u
-    return users
+    return users, changed
 
 # ------------------------ MIGRATION (non-destructive) ------------------------
 def _looks_encrypted_key(s: str) -> bool:
@@ -226,31 +368,125 @@ def _migrate_encrypted_keys(users):
             continue
     return users, changed
 
+# ------------------------ SHARDED USERS STORAGE ------------------------
+def _user_path(uid):
+    return os.path.join(USERS_DIR, f"{uid}.json")
+
+def _shards_enabled():
+    return os.path.isdir(USERS_DIR)
+
+# сырые байты последней нашей записи шарда: (stat-ключ, payload);
+# если сериализация не изменилась И файл на диске всё ещё наш —
+# запись можно пропустить целиком (save_users всей базы трогает
+# только реально изменившиеся шарды)
+_SHARD_RAW = {}
+
+def _save_user_shard(uid, u):
+    path = _user_path(uid)
+    payload = _dumps(u)
+    ent = _SHARD_RAW.get(path)
+    if ent is not None and ent[1] == payload:
+        try:
+            st = os.stat(path)
+            if (st.st_mtime_ns, st.st_size) == ent[0]:
+                return
+        except OSError:
+            pass
+    try:
+        tmp = path + ".tmp"
+        with open(tmp, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        st = os.stat(path)
+        key = (st.st_mtime_ns, st.st_size)
+        with _CACHE_LOCK:
+            global _CACHE_VERSION
+            _CACHE_VERSION += 1
+            _CACHE[path] = (key, u)
+        _SHARD_RAW[path] = (key, payload)
+    except Exception:
+        traceback.print_exc()
+
+def _migrate_users_to_shards():
+    """Одноразовая миграция users.json -> users/<uid>.json.
+    Старый файл не трогаем — он остаётся как бэкап."""
+    if _shards_enabled():
+        return
+    users = _read(USERS_FILE, {}) if os.path.exists(USERS_FILE) else {}
+    try:
+        os.makedirs(USERS_DIR, exist_ok=True)
+        for uid, u in users.items():
+            _save_user_shard(str(uid), u)
+    except Exception:
+        traceback.print_exc()
+
+def _refresh_indexes(users):
+    global _IDX_VERSION
+    if _IDX_VERSION == _CACHE_VERSION:
+        return
+    _rebuild_user_indexes(users)
+    _IDX_VERSION = _CACHE_VERSION
+
 # ------------------------ CRUD ------------------------
 def load_users(path=None):
-    _ensure_files()
-    return _read(path or USERS_FILE, {})
+    # _ensure_files отработал на старте; _read_cached сам восстановит файл,
+    # если его кто-то удалил (OSError от stat)
+    if path is not None:
+        return _read_cached(path, {})
+    if _shards_enabled():
+        users = {}
+        try:
+            for fn in os.listdir(USERS_DIR):
+                if not fn.endswith('.json'):
+                    continue
+                u = _read_cached(os.path.join(USERS_DIR, fn), None)
+                if isinstance(u, dict):
+                    users[fn[:-5]] = u
+        except OSError:
+            traceback.print_exc()
+    else:
+        users = _read_cached(USERS_FILE, {})
+    _refresh_indexes(users)
+    return users
 
 def save_users(data, path=None):
+    if path is None and _shards_enabled():
+        with LOCK:
+            for uid, u in data.items():
+                _save_user_shard(str(uid), u)
+        return
     with LOCK:
         _write(path or USERS_FILE, data)
 
+def _save_user(uid, users, path=None):
+    """Точечная запись одного пользователя: в shard-режиме пишется один
+    маленький файл вместо сериализации всей базы."""
+    if path is None and _shards_enabled():
+        with LOCK:
+            _save_user_shard(str(uid), users[str(uid)])
+        return
+    save_users(users, path)
+
 def get_user(uid, path=None):
     users = load_users(path)
-    users = _ensure_user_defaults(users, uid)
-    # do not always force a save here unless something changed to reduce I/O
-    save_users(users, path)
+    users, changed = _ensure_user_defaults(users, uid)
+    # save only when normalization actually added something — reads stay read-only
+    if changed:
+        _save_user(uid, users, path)
     return users[str(uid)]
 
 def create_default_user(uid, username=None, path=None):
     users = load_users(path)
-    users = _ensure_user_defaults(users, uid, username)
-    save_users(users, path)
+    users, changed = _ensure_user_defaults(users, uid, username)
+    if changed:
+        _save_user(uid, users, path)
     return users[str(uid)]
 
 def set_api_keys(uid, api_key, api_secret, path=None):
     users = load_users(path)
-    users = _ensure_user_defaults(users, uid)
+    users, _ = _ensure_user_defaults(users, uid)
     u = users[str(uid)]
     # store plain text (as requested)
     u['api_key'] = (api_key or "").strip()
@@ -262,35 +498,130 @@ def set_api_keys(uid, api_key, api_secret, path=None):
         if k in u:
             u.pop(k, None)
     users[str(uid)] = u
-    save_users(users, path)
+    _save_user(uid, users, path)
 
 def update_setting(uid, key, value, path=None):
     users = load_users(path)
-    users = _ensure_user_defaults(users, uid)
+    users, _ = _ensure_user_defaults(users, uid)
     if 'settings' not in users[str(uid)] or not isinstance(users[str(uid)]['settings'], dict):
         users[str(uid)]['settings'] = {}
     users[str(uid)]['settings'][key] = value
-    save_users(users, path)
+    _save_user(uid, users, path)
     return users[str(uid)]['settings']
 
+def toggle_setting(uid, key, default=True, path=None):
+    """Atomically flip a boolean setting in one load-modify-write.
+
+    Returns (new_value, settings) so callers can re-render without an
+    extra get_user round-trip."""
+    users = load_users(path)
+    users, _ = _ensure_user_defaults(users, uid)
+    if 'settings' not in users[str(uid)] or not isinstance(users[str(uid)]['settings'], dict):
+        users[str(uid)]['settings'] = {}
+    settings = users[str(uid)]['settings']
+    new_value = not bool(settings.get(key, default))
+    settings[key] = new_value
+    _save_user(uid, users, path)
+    return new_value, settings
+
+def _dumps_line(obj):
+    if orjson is not None:
+        return orjson.dumps(obj) + b'\n'
+    return (json.dumps(obj, ensure_ascii=False) + '\n').encode('utf-8')
+
+def _iter_trades_ndjson(path):
+    loads = orjson.loads if orjson is not None else json.loads
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield loads(line)
+            except Exception:
+                continue
+
+def _migrate_trades_to_ndjson():
+    """Одноразовая миграция: trades.json (массив) -> trades.ndjson (журнал).
+    Старый файл не трогаем — он остаётся как бэкап."""
+    if os.path.exists(TRADES_NDJSON):
+        return
+    arr = _read(TRADES_FILE, []) if os.path.exists(TRADES_FILE) else []
+    try:
+        tmp = TRADES_NDJSON + ".tmp"
+        with open(tmp, 'wb') as f:
+            for tr in arr:
+                f.write(_dumps_line(tr))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, TRADES_NDJSON)
+    except Exception:
+        traceback.print_exc()
+
 def append_trade(tr, path=None):
-    path = path or TRADES_FILE
+    if path is not None:
+        # явный legacy-путь (массив в одном файле) — старое поведение
+        with LOCK:
+            arr = _read(path, [])
+            arr.append(tr)
+            _write(path, arr)
+        return
+    with LOCK:
+        _migrate_trades_to_ndjson()
+        try:
+            with open(TRADES_NDJSON, 'ab') as f:
+                f.write(_dumps_line(tr))
+        except Exception:
+            traceback.print_exc()
+
+def load_trades():
+    """Полный список сделок из append-only журнала (после миграции)."""
     with LOCK:
-        arr = _read(path, [])
-        arr.append(tr)
-        _write(path, arr)
+        _migrate_trades_to_ndjson()
+    if not os.path.exists(TRADES_NDJSON):
+        return []
+    try:
+        return list(_iter_trades_ndjson(TRADES_NDJSON))
+    except Exception:
+        traceback.print_exc()
+        return []
 
 def get_trades_for_user(uid, limit=100, path=None):
-    trades = _read(path or TRADES_FILE, [])
     uid = str(uid)
-    return [t for t in trades if str(t.get('user_id')) == uid][-limit:]
+    if path is not None:
+        # legacy-файл с массивом
+        if _SIMD_PARSER is not None and os.path.exists(path):
+            # SIMD tokenization + lazy materialization: only matching rows become dicts
+            try:
+                with open(path, 'rb') as f:
+                    doc = _SIMD_PARSER.parse(f.read())
+                out = []
+                for t in doc:
+                    if str(t.get('user_id')) == uid:
+                        out.append(t.as_dict())
+                return out[-limit:]
+            except Exception:
+                traceback.print_exc()
+        trades = _read(path, [])
+        return [t for t in trades if str(t.get('user_id')) == uid][-limit:]
+    with LOCK:
+        _migrate_trades_to_ndjson()
+    if not os.path.exists(TRADES_NDJSON):
+        return []
+    dq = deque(maxlen=limit)
+    try:
+        for obj in _iter_trades_ndjson(TRADES_NDJSON):
+            if str(obj.get('user_id')) == uid:
+                dq.append(obj)
+    except Exception:
+        traceback.print_exc()
+    return list(dq)
 
 # ------------------------ TRIAL HELPERS (consistent) ------------------------
 def has_used_trial(user_id: int) -> bool:
     try:
-        u = get_user(user_id) or {}
-        settings = u.get("settings") or {}
-        return bool(settings.get("used_trial", False))
+        load_users()
+        return _TRIAL_IDX.get(str(user_id), False)
     except Exception:
         return False
 
@@ -304,21 +635,14 @@ def set_used_trial(user_id: int, used: bool = True):
 # ------------------------ AUTO START (safe) ------------------------
 def _startup():
     _ensure_files()
+    _migrate_users_to_shards()
     users = load_users()
     changed = False
 
     # normalize each user (merge-only)
     for uid in list(users.keys()):
-        try:
-            before = json.dumps(users.get(uid), sort_keys=True)
-        except Exception:
-            before = None
-        users = _ensure_user_defaults(users, uid)
-        try:
-            after = json.dumps(users.get(uid), sort_keys=True)
-        except Exception:
-            after = None
-        if before != after:
+        users, user_changed = _ensure_user_defaults(users, uid)
+        if user_changed:
             changed = True
 
     # non-destructive migration of encrypted keys (mark only)
@@ -331,4 +655,8 @@ def _startup():
 
     print("[DB_JSON] Готово — пользователи нормализованы, безопасно. ✅")
 
-_startup()
+# автозапуск можно отключить (DB_JSON_AUTO_START=0) — например, в тестах
+# или когда процесс просто читает данные; _startup идемпотентен и его
+# можно вызвать явно в любой момент
+if os.getenv('DB_JSON_AUTO_START', '1') == '1':
+    _startup()
@@ -7,11 +7,26 @@
 # СДЕЛАЙ БЭКАП users.json ПЕРЕД ЗАПУСКОМ: копия будет создана автоматически.
 
 import os
+import re
 import json
+import mmap
+import shutil
 import getpass
 from pathlib import Path
+
+try:
+    import termios
+except ImportError:
+    termios = None  # Windows — работаем через обычный getpass
 from datetime import datetime
 
+# orjson (Rust) сериализует сразу в bytes — без пер-символьного escaping
+# и без .encode() round-trip; при отсутствии — откат на stdlib json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # --- DISABLED Fernet encryption: no-op wrappers (inserted by remove_encryption.py) ---
 # def encrypt(value):
 #     # encryption disabled - return plain value
@@ -31,18 +46,30 @@ def load_users():
     if not p.exists():
         print("users.json не найден:", USERS_FILE)
         raise SystemExit(1)
+    if orjson is not None:
+        return orjson.loads(p.read_bytes())
     return json.loads(p.read_text(encoding="utf-8"))
 
 
 def save_users(users):
     p = Path(USERS_FILE)
-    p.write_text(json.dumps(users, indent=4, ensure_ascii=False), encoding="utf-8")
+    if orjson is not None:
+        payload = orjson.dumps(users, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    else:
+        payload = json.dumps(users, indent=4, ensure_ascii=False).encode("utf-8")
+    # пишем во временный файл и подменяем через rename: бэкап — hardlink на
+    # старый inode, перезапись на месте испортила бы и его
+    tmp = str(p) + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(payload)
+    os.replace(tmp, p)
 
 
-def try_decrypt_with_fernet(fkey, cipher_text):
+def make_fernet(fkey):
     """
-    Try decrypting cipher_text using provided fkey (FERNET key).
-    Returns (plaintext, None) on success, (None, error_message) on failure.
+    Build the Fernet cipher ONCE (base64 key parse + key split happen here),
+    then reuse it for every token. Returns (fernet, None) on success,
+    (None, error_message) on failure.
     """
     try:
         from cryptography.fernet import Fernet
@@ -50,7 +77,17 @@ def try_decrypt_with_fernet(fkey, cipher_text):
         return None, "cryptography not installed: " + str(e)
     try:
         key = fkey.encode() if isinstance(fkey, str) else fkey
-        f = Fernet(key)
+        return Fernet(key), None
+    except Exception as e:
+        return None, str(e)
+
+
+def try_decrypt_with_fernet(f, cipher_text):
+    """
+    Try decrypting cipher_text using a pre-built Fernet object.
+    Returns (plaintext, None) on success, (None, error_message) on failure.
+    """
+    try:
         # cipher_text expected to be str
         if isinstance(cipher_text, str):
             ct = cipher_text.encode()
@@ -62,10 +99,80 @@ def try_decrypt_with_fernet(fkey, cipher_text):
         return None, str(e)
 
 
+# Fernet-токен именно в полях ключей — один проход C-движка re по mmap-буферу
+# вместо Python-итерации по пользователям
+_ENC_FIELD_RE = re.compile(rb'"(?:api_key|api_secret)"\s*:\s*"gAAAAA')
+
+
+def has_encrypted_marker():
+    """Быстрая проверка без JSON-парсинга: ищем сигнатуру Fernet-токена
+    прямо в байтах файла через mmap. Возвращает None, если проверить
+    не удалось (пусть тогда решает обычный путь через load_users)."""
+    try:
+        fd = os.open(USERS_FILE, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        try:
+            mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # пустой файл — шифрованных записей точно нет
+            return False
+        try:
+            return _ENC_FIELD_RE.search(mm) is not None
+        finally:
+            mm.close()
+    finally:
+        os.close(fd)
+
+
+def batch_getpass(prompts):
+    """Серия скрытых промптов за один сеанс работы с tty: открываем /dev/tty
+    и гасим ECHO один раз на всю пачку, а не на каждый вопрос (getpass
+    делает open/tcgetattr/tcsetattr/close на каждый вызов)."""
+    if termios is None:
+        return [getpass.getpass(p) for p in prompts]
+    try:
+        fd = os.open("/dev/tty", os.O_RDWR | os.O_NOCTTY)
+    except OSError:
+        return [getpass.getpass(p) for p in prompts]
+    try:
+        old = termios.tcgetattr(fd)
+    except termios.error:
+        os.close(fd)
+        return [getpass.getpass(p) for p in prompts]
+    try:
+        new = list(old)
+        new[3] = new[3] & ~termios.ECHO
+        termios.tcsetattr(fd, termios.TCSADRAIN, new)
+        out = []
+        for p in prompts:
+            os.write(fd, p.encode())
+            buf = b""
+            while True:
+                ch = os.read(fd, 1)
+                if not ch or ch in b"\r\n":
+                    break
+                buf += ch
+            os.write(fd, b"\n")
+            out.append(buf.decode(errors="replace"))
+        return out
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, old)
+        os.close(fd)
+
+
 def backup_file(path):
     p = Path(path)
     bak = str(p) + BACKUP_SUFFIX
-    p.rename(bak)
+    try:
+        # hardlink: O(1) операция над inode, без копирования байт и без окна,
+        # когда users.json не существует (как было с rename)
+        os.link(p, bak)
+    except OSError:
+        # файловая система без hardlink'ов — обычная копия
+        # (shutil сам использует быстрые ядровые пути копирования)
+        shutil.copyfile(p, bak, follow_symlinks=False)
     print("Создан бэкап:", bak)
     return bak
 
@@ -73,18 +180,18 @@ def backup_file(path):
 def main():
     print("FIX KEYS PLAIN — старт")
     print("Путь users.json:", USERS_FILE)
+    # частый случай «чинить нечего» отсекаем mmap-сканом файла,
+    # не материализуя JSON в память
+    if has_encrypted_marker() is False:
+        print("Шифрованных записей не найдено. Ничего делать не нужно.")
+        return
     users = load_users()
     # find any entries with api_key/api_secret starting with gAAAAA
-    to_fix = []
-    for uid, u in users.items():
-        api = (u.get("api_key") or "")
-        sec = (u.get("api_secret") or "")
-        if isinstance(api, str) and api.startswith("gAAAAA"):
-            to_fix.append(uid)
-            continue
-        if isinstance(sec, str) and sec.startswith("gAAAAA"):
-            to_fix.append(uid)
-            continue
+    to_fix = [
+        uid for uid, u in users.items()
+        if str(u.get("api_key") or "").startswith("gAAAAA")
+        or str(u.get("api_secret") or "").startswith("gAAAAA")
+    ]
 
     if not to_fix:
         print("Шифрованных записей не найдено. Ничего делать не нужно.")
@@ -95,6 +202,12 @@ def main():
     bak = backup_file(USERS_FILE)
 
     fkey = os.getenv("FERNET_KEY")
+    # cipher строится один раз на все uid, а не по разу на каждый токен
+    cipher = None
+    if fkey:
+        cipher, err = make_fernet(fkey)
+        if cipher is None:
+            print("FERNET_KEY задан, но построить cipher не удалось:", err)
     changed = False
 
     for uid in to_fix:
@@ -103,8 +216,8 @@ def main():
         sec = (u.get("api_secret") or "")
         print("\n--- uid:", uid)
         # try decrypt if fkey present
-        if fkey and isinstance(api, str) and api.startswith("gAAAAA"):
-            plain_api, err = try_decrypt_with_fernet(fkey, api)
+        if cipher is not None and isinstance(api, str) and api.startswith("gAAAAA"):
+            plain_api, err = try_decrypt_with_fernet(cipher, api)
             if plain_api:
                 print("Расшифрован api_key (FERNET_KEY) — заменяю.")
                 users[uid]['api_key'] = plain_api
@@ -114,8 +227,8 @@ def main():
         elif isinstance(api, str) and api.startswith("gAAAAA"):
             print("api_key зашифрован, но FERNET_KEY не задан — нужно ввести вручную или задать FERNET_KEY.")
         # same for secret
-        if fkey and isinstance(sec, str) and sec.startswith("gAAAAA"):
-            plain_sec, err = try_decrypt_with_fernet(fkey, sec)
+        if cipher is not None and isinstance(sec, str) and sec.startswith("gAAAAA"):
+            plain_sec, err = try_decrypt_with_fernet(cipher, sec)
             if plain_sec:
                 print("Расшифрован api_secret (FERNET_KEY) — заменяю.")
                 users[uid]['api_secret'] = plain_sec
@@ -125,15 +238,26 @@ def main():
         elif isinstance(sec, str) and sec.startswith("gAAAAA"):
             print("api_secret зашифрован, но FERNET_KEY не задан — нужно ввести вручную или задать FERNET_KEY.")
 
-        # If still encrypted (no fkey or decrypt failed) — ask user to input
-        if isinstance(users[uid].get('api_key', ''), str) and users[uid]['api_key'].startswith("gAAAAA"):
-            new_api = input("Вставь plain api_key для uid " + str(uid) + " (или Enter, чтобы пропустить): ").strip()
-            if new_api:
-                users[uid]['api_key'] = new_api
-                changed = True
+    # If still encrypted (no fkey or decrypt failed) — ask user to input.
+    # api_key видимым input'ом по одному; все api_secret — одной пачкой
+    # через batch_getpass (tty открывается и ECHO гасится один раз)
+    still_api = [uid for uid in to_fix
+                 if isinstance(users[uid].get('api_key', ''), str)
+                 and users[uid]['api_key'].startswith("gAAAAA")]
+    for uid in still_api:
+        new_api = input("Вставь plain api_key для uid " + str(uid) + " (или Enter, чтобы пропустить): ").strip()
+        if new_api:
+            users[uid]['api_key'] = new_api
+            changed = True
 
-        if isinstance(users[uid].get('api_secret', ''), str) and users[uid]['api_secret'].startswith("gAAAAA"):
-            new_sec = getpass.getpass("Вставь plain api_secret (скрыто) для uid " + str(uid) + " (или Enter, чтобы пропустить): ").strip()
+    still_sec = [uid for uid in to_fix
+                 if isinstance(users[uid].get('api_secret', ''), str)
+                 and users[uid]['api_secret'].startswith("gAAAAA")]
+    if still_sec:
+        prompts = ["Вставь plain api_secret (скрыто) для uid " + str(uid) + " (или Enter, чтобы пропустить): "
+                   for uid in still_sec]
+        for uid, new_sec in zip(still_sec, batch_getpass(prompts)):
+            new_sec = new_sec.strip()
             if new_sec:
                 users[uid]['api_secret'] = new_sec
                 changed = True
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+# СГЕНЕРИРОВАНО build_locale.py — НЕ ПРАВИТЬ РУКАМИ.
+# Источник: словарь LOCALE в tg_app.py.
+
+
+def t_fast(lang, key):
+    match lang:
+        case 'ru':
+            match key:
+                case 'action_cancelled':
+                    return 'Действие отменено.'
+                case 'add_pair_button':
+                    return '➕ Добавить пару'
+                case 'admin_only':
+                    return '❌ Только админ.'
+                case 'buy_fail':
+                    return '❌ Не удалось создать счёт. Попробуйте позже.'
+                case 'buy_success':
+                    return '👉 Ссылка на оплату: {url}\nПосле оплаты подписка активируется автоматически.'
+                case 'choose_lang':
+                    return 'Выберите язык / Choose language:'
+                case 'enter_api_key':
+                    return 'Введите API Key (в следующем сообщении):'
+                case 'enter_api_secret':
+                    return 'Теперь введите API Secret (в следующем сообщении):'
+                case 'enter_reply_prompt':
+                    return 'Введите ответ пользователю {user_id}. Для отмены: /cancel'
+                case 'error_data':
+                    return 'Ошибка данных.'
+                case 'indicators_advanced_text':
+                    return '🔧 Расширенные настройки (текущие):\n\n{settings}\n\nЧтобы изменить значение используйте команду:\nSET KEY VALUE\n\nПример: SET RSI_PERIOD 14'
+                case 'indicators_global_title':
+                    return '🌐 Глобальные настройки индикаторов:\nНажмите кнопку, чтобы переключить индикатор.'
+                case 'indicators_menu_title':
+                    return '⚙️ Настройки индикаторов — выберите раздел:'
+                case 'invalid_keys':
+                    return '❌ Неверные или недостаточные права API ключей: {info}\nПроверьте ключи и права (баланс/торговля).'
+                case 'invalid_user_id':
+                    return '❌ Некорректный идентификатор пользователя.'
+                case 'invoice_paid':
+                    return '✅ Оплата получена! Ваша подписка активирована на {days} дней.'
+                case 'keys_saved_no_client':
+                    return 'Ключи сохранены, но сервер не настроен для проверки ключей.'
+                case 'keys_saved_ok':
+                    return '✅ API ключи сохранены и успешно проверены.'
+                case 'keys_saved_warn':
+                    return '❗️ Ключи сохранены, но проверка не прошла: {info}\nПроверьте права ключей (read/balance/trade) и флаг TESTNET.'
+                case 'manage_pairs_title':
+                    return 'Ваши текущие пары:\n{pairs}\n\nВыберите действие:'
+                case 'menu_bot_off':
+                    return '🤖 Бот: ВЫКЛ'
+                case 'menu_bot_on':
+                    return '🤖 Бот: ВКЛ'
+                case 'menu_info':
+                    return 'ℹ️ ИНФО'
+                case 'menu_settings':
+                    return '⚙️ Настройки'
+                case 'menu_subscription':
+                    return '📊 Подписка'
+                case 'menu_support':
+                    return '🆘 Поддержка'
+                case 'menu_trades':
+                    return '💹 Мои сделки'
+                case 'no_keys':
+                    return '❌ У вас не добавлены API ключи. Добавьте их в ⚙️ Настройки -> API ключи.'
+                case 'no_pairs_yet':
+                    return 'У вас ещё нет сохранённых пар.'
+                case 'no_trades':
+                    return '💤 Сделок пока нет.'
+                case 'pair_added':
+                    return '✅ Пара(ы) добавлены: {pairs}'
+                case 'pair_not_found':
+                    return '❌ Пара {pair} не найдена в вашем списке.'
+                case 'pair_removed':
+                    return '✅ Пара {pair} удалена.'
+                case 'pairs_done_button':
+                    return '✅ Готово'
+                case 'pairs_input_prompt':
+                    return 'Введите пары через запятую или пробелы (например: BTCUSDT, ETHUSDT или BTC/USDT):'
+                case 'pairs_invalid_none':
+                    return '❌ Никакие введённые пары не были распознаны как действительные: {invalid}'
+                case 'pairs_manual_button':
+                    return '✏️ Ввести свои'
+                case 'pairs_manual_saved':
+                    return '✅ Ваши пары сохранены: {pairs}'
+                case 'pairs_saved':
+                    return '✅ Выбранные пары сохранены: {pairs}'
+                case 'pairs_saved_partial':
+                    return '✅ Сохранены: {valid}. Необработаны/недействительны: {invalid}'
+                case 'pairs_title':
+                    return 'Выберите торговые пары (нажмите, чтобы переключить) или введите свои:'
+                case 'pairs_title_short':
+                    return 'Выбор пар'
+                case 'remove_pair_button':
+                    return '➖ Удалить пару'
+                case 'reply_sent':
+                    return '✅ Ответ отправлен пользователю.'
+                case 'risk_title':
+                    return 'Текущие risk-настройки:\n{fields}\n\nИзменить: SET KEY VALUE'
+                case 'save_failed':
+                    return '❌ Не удалось сохранить ключи. Попробуйте позже.'
+                case 'set_usage':
+                    return 'Ошибка. Формат: SET KEY VALUE'
+                case 'settings_back':
+                    return '⬅ Назад'
+                case 'settings_lang':
+                    return '🌐 Язык / Language'
+                case 'settings_menu_title':
+                    return '⚙️ Меню настроек — выберите раздел:'
+                case 'settings_testnet_status':
+                    return '🌐 TESTNET переключён {status}.'
+                case 'subscribe_required':
+                    return '🔒 У вас нет активной подписки. Купите подписку через меню или /buy.'
+                case 'support_failed':
+                    return 'Ошибка при отправке в поддержку. Попробуйте позже.'
+                case 'support_prompt':
+                    return 'Опишите проблему — ваше сообщение будет отправлено админу. Для отмены введите /cancel'
+                case 'support_sent':
+                    return '✅ Сообщение отправлено в поддержку. Ожидайте ответа.'
+                case 'trade_mode_set_ok':
+                    return '✅ Режим торговли установлен: {mode}'
+                case 'trade_mode_title':
+                    return 'Режим торговли — текущий: {current}\nВыберите режим:'
+                case 'trade_notification':
+                    return '⚡️ Сделка: {symbol} {side}\nЦена: {price}\nОбъём: {qty}\nPnL: {pnl}\n{ts}'
+                case 'trades_end':
+                    return '— Конец —'
+                case 'trading_off':
+                    return '⏸️ Торговля отключена.'
+                case 'trading_on':
+                    return '▶️ Торговля включена.'
+                case 'welcome':
+                    return '👋 Привет! Это JamesTrade.\nВыберите пункт меню ниже:'
+                case 'welcome_short':
+                    return '🤖 Команды: /buy — оплатить подписку; SET KEY VALUE — изменить настройку.'
+        case 'en':
+            match key:
+                case 'action_cancelled':
+                    return 'Action cancelled.'
+                case 'add_pair_button':
+                    return '➕ Add pair'
+                case 'admin_only':
+                    return '❌ Admin only.'
+                case 'buy_fail':
+                    return '❌ Failed to create invoice. Try later.'
+                case 'buy_success':
+                    return '👉 Payment link: {url}\nAfter payment your subscription will be activated automatically.'
+                case 'choose_lang':
+                    return 'Choose language / Выберите язык:'
+                case 'enter_api_key':
+                    return 'Enter API Key (in the next message):'
+                case 'enter_api_secret':
+                    return 'Now enter API Secret (in the next message):'
+                case 'enter_reply_prompt':
+                    return 'Enter reply to user {user_id}. To cancel: /cancel'
+                case 'error_data':
+                    return 'Bad data.'
+                case 'indicators_advanced_text':
+                    return '🔧 Advanced settings (current):\n\n{settings}\n\nTo change use:\nSET KEY VALUE\n\nExample: SET RSI_PERIOD 14'
+                case 'indicators_global_title':
+                    return '🌐 Global indicator toggles:\nPress button to toggle an indicator.'
+                case 'indicators_menu_title':
+                    return '⚙️ Indicator settings — choose:'
+                case 'invalid_keys':
+                    return '❌ Invalid or insufficient API key permissions: {info}\nCheck keys and permissions (balance/trade).'
+                case 'invalid_user_id':
+                    return '❌ Invalid user id.'
+                case 'invoice_paid':
+                    return '✅ Payment received! Your subscription is activated for {days} days.'
+                case 'keys_saved_no_client':
+                    return 'Keys saved but server cannot validate keys (client.py missing).'
+                case 'keys_saved_ok':
+                    return '✅ API keys saved and validated successfully.'
+                case 'keys_saved_warn':
+                    return '❗️ Keys saved but validation failed: {info}\nCheck key permissions (read/balance/trade) and TESTNET flag.'
+                case 'manage_pairs_title':
+                    return 'Your current pairs:\n{pairs}\n\nChoose action:'
+                case 'menu_bot_off':
+                    return '🤖 Bot: OFF'
+                case 'menu_bot_on':
+                    return '🤖 Bot: ON'
+                case 'menu_info':
+                    return 'ℹ️ INFO'
+                case 'menu_settings':
+                    return '⚙️ Settings'
+                case 'menu_subscription':
+                    return '📊 Subscription'
+                case 'menu_support':
+                    return '🆘 Support'
+                case 'menu_trades':
+                    return '💹 My trades'
+                case 'no_keys':
+                    return "❌ You haven't added API keys. Add them in ⚙️ Settings -> API keys."
+                case 'no_pairs_yet':
+                    return 'You have no saved pairs yet.'
+                case 'no_trades':
+                    return '💤 No trades yet.'
+                case 'pair_added':
+                    return '✅ Pair(s) added: {pairs}'
+                case 'pair_not_found':
+                    return '❌ Pair {pair} not found in your list.'
+                case 'pair_removed':
+                    return '✅ Pair {pair} removed.'
+                case 'pairs_done_button':
+                    return '✅ Done'
+                case 'pairs_input_prompt':
+                    return 'Enter pairs separated by comma or spaces (e.g. BTCUSDT, ETHUSDT):'
+                case 'pairs_invalid_none':
+                    return '❌ None of the entered pairs were recognized: {invalid}'
+                case 'pairs_manual_button':
+                    return '✏️ Enter custom'
+                case 'pairs_manual_saved':
+                    return '✅ Your pairs saved: {pairs}'
+                case 'pairs_saved':
+                    return '✅ Pairs saved: {pairs}'
+                case 'pairs_saved_partial':
+                    return '✅ Saved: {valid}. Invalid/unrecognized: {invalid}'
+                case 'pairs_title':
+                    return 'Choose trading pairs (tap to toggle) or enter your own:'
+                case 'pairs_title_short':
+                    return 'Выбор пар'
+                case 'remove_pair_button':
+                    return '➖ Remove pair'
+                case 'reply_sent':
+                    return '✅ Reply sent to the user.'
+                case 'risk_title':
+                    return 'Current risk settings:\n{fields}\n\nChange with: SET KEY VALUE'
+                case 'save_failed':
+                    return '❌ Failed to save API keys. Try again later.'
+                case 'set_usage':
+                    return 'Error. Format: SET KEY VALUE'
+                case 'settings_back':
+                    return '⬅ Back'
+                case 'settings_lang':
+                    return '🌐 Language'
+                case 'settings_menu_title':
+                    return '⚙️ Settings menu — choose section:'
+                case 'settings_testnet_status':
+                    return '🌐 TESTNET toggled {status}.'
+                case 'subscribe_required':
+                    return "🔒 You don't have an active subscription. Buy it in menu or /buy."
+                case 'support_failed':
+                    return 'Failed to forward to support. Try later.'
+                case 'support_prompt':
+                    return 'Describe the issue — your message will be sent to admin. To cancel, use /cancel'
+                case 'support_sent':
+                    return '✅ Message sent to support. Wait for reply.'
+                case 'trade_mode_set_ok':
+                    return '✅ Trade mode set: {mode}'
+                case 'trade_mode_title':
+                    return 'Trade mode — current: {current}\nChoose mode:'
+                case 'trade_notification':
+                    return '⚡️ Trade: {symbol} {side}\nPrice: {price}\nQty: {qty}\nPnL: {pnl}\n{ts}'
+                case 'trades_end':
+                    return '— End —'
+                case 'trading_off':
+                    return '⏸️ Trading disabled.'
+                case 'trading_on':
+                    return '▶️ Trading enabled.'
+                case 'welcome':
+                    return '👋 Hi! This is JamesTrade.\nChoose an item from the menu:'
+                case 'welcome_short':
+                    return '🤖 Commands: /buy — pay subscription; SET KEY VALUE — change setting.'
+        case 'es':
+            match key:
+                case 'action_cancelled':
+                    return 'Acción cancelada.'
+                case 'add_pair_button':
+                    return '➕ Añadir par'
+                case 'admin_only':
+                    return '❌ Solo administrador.'
+                case 'buy_fail':
+                    return '❌ No se pudo crear la factura. Intenta más tarde.'
+                case 'buy_success':
+                    return '👉 Enlace de pago: {url}\nTras el pago, la suscripción se activará automáticamente.'
+                case 'choose_lang':
+                    return 'Elige idioma / Choose language:'
+                case 'enter_api_key':
+                    return 'Introduce API Key (en el siguiente mensaje):'
+                case 'enter_api_secret':
+                    return 'Ahora introduce API Secret (en el siguiente mensaje):'
+                case 'enter_reply_prompt':
+                    return 'Introduce la respuesta al usuario {user_id}. Para cancelar: /cancel'
+                case 'error_data':
+                    return 'Datos erróneos.'
+                case 'indicators_advanced_text':
+                    return '🔧 Ajustes avanzados (actuales):\n\n{settings}\n\nPara cambiar usa:\nSET KEY VALUE\n\nEjemplo: SET RSI_PERIOD 14'
+                case 'indicators_global_title':
+                    return '🌐 Indicadores globales:\nPulsa para alternar un indicador.'
+                case 'indicators_menu_title':
+                    return '⚙️ Ajustes de indicadores — elige:'
+                case 'invalid_keys':
+                    return '❌ Claves inválidas o permisos insuficientes: {info}\nVerifica las claves y permisos (balance/trade).'
+                case 'invalid_user_id':
+                    return '❌ Id de usuario inválido.'
+                case 'invoice_paid':
+                    return '✅ ¡Pago recibido! Tu suscripción está activada por {days} días.'
+                case 'keys_saved_no_client':
+                    return 'Claves guardadas, pero el servidor no puede validar (client.py ausente).'
+                case 'keys_saved_ok':
+                    return '✅ Claves API guardadas y validadas con éxito.'
+                case 'keys_saved_warn':
+                    return '❗️ Claves guardadas, pero la validación falló: {info}\nVerifica permisos (read/balance/trade) y TESTNET.'
+                case 'manage_pairs_title':
+                    return 'Tus pares actuales:\n{pairs}\n\nElige acción:'
+                case 'menu_bot_off':
+                    return '🤖 Bot: OFF'
+                case 'menu_bot_on':
+                    return '🤖 Bot: ON'
+                case 'menu_info':
+                    return 'ℹ️ INFO'
+                case 'menu_settings':
+                    return '⚙️ Ajustes'
+                case 'menu_subscription':
+                    return '📊 Suscripción'
+                case 'menu_support':
+                    return '🆘 Soporte'
+                case 'menu_trades':
+                    return '💹 Mis operaciones'
+                case 'no_keys':
+                    return '❌ No has añadido claves API. Añádelas en ⚙️ Ajustes -> API keys.'
+                case 'no_pairs_yet':
+                    return 'Todavía no tienes pares guardados.'
+                case 'no_trades':
+                    return '💤 Aún no hay operaciones.'
+                case 'pair_added':
+                    return '✅ Par(es) añadidos: {pairs}'
+                case 'pair_not_found':
+                    return '❌ Par {pair} no encontrado en tu lista.'
+                case 'pair_removed':
+                    return '✅ Par {pair} eliminado.'
+                case 'pairs_done_button':
+                    return '✅ Hecho'
+                case 'pairs_input_prompt':
+                    return 'Introduce pares separados por comas o espacios (p. ej.: BTCUSDT, ETHUSDT):'
+                case 'pairs_invalid_none':
+                    return '❌ Ninguno de los pares introducidos fue reconocido como válido: {invalid}'
+                case 'pairs_manual_button':
+                    return '✏️ Introducir propios'
+                case 'pairs_manual_saved':
+                    return '✅ Tus pares guardados: {pairs}'
+                case 'pairs_saved':
+                    return '✅ Pares guardados: {pairs}'
+                case 'pairs_saved_partial':
+                    return '✅ Guardados: {valid}. No reconocidos/invalidos: {invalid}'
+                case 'pairs_title':
+                    return 'Elige pares de trading (toca para alternar) o introduce los tuyos:'
+                case 'pairs_title_short':
+                    return 'Выбор пар'
+                case 'remove_pair_button':
+                    return '➖ Eliminar par'
+                case 'reply_sent':
+                    return '✅ Respuesta enviada al usuario.'
+                case 'risk_title':
+                    return 'Ajustes de riesgo actuales:\n{fields}\n\nCambiar: SET KEY VALUE'
+                case 'save_failed':
+                    return '❌ No se pudieron guardar las claves. Intenta más tarde.'
+                case 'set_usage':
+                    return 'Error. Formato: SET KEY VALUE'
+                case 'settings_back':
+                    return '⬅ Volver'
+                case 'settings_lang':
+                    return '🌐 Idioma'
+                case 'settings_menu_title':
+                    return '⚙️ Menú de ajustes — elige sección:'
+                case 'settings_testnet_status':
+                    return '🌐 TESTNET cambiado a {status}.'
+                case 'subscribe_required':
+                    return '🔒 No tienes una suscripción activa. Cómprala en el menú o /buy.'
+                case 'support_failed':
+                    return 'Error al enviar al soporte. Intenta más tarde.'
+                case 'support_prompt':
+                    return 'Describe el problema — tu mensaje se enviará al administrador. Para cancelar usa /cancel'
+                case 'support_sent':
+                    return '✅ Mensaje enviado al soporte. Espera respuesta.'
+                case 'trade_mode_set_ok':
+                    return '✅ Modo de trading establecido: {mode}'
+                case 'trade_mode_title':
+                    return 'Modo de trading — actual: {current}\nElige modo:'
+                case 'trade_notification':
+                    return '⚡️ Operación: {symbol} {side}\nPrecio: {price}\nCantidad: {qty}\nPnL: {pnl}\n{ts}'
+                case 'trades_end':
+                    return '— Fin —'
+                case 'trading_off':
+                    return '⏸️ Trading desactivado.'
+                case 'trading_on':
+                    return '▶️ Trading activado.'
+                case 'welcome':
+                    return '👋 ¡Hola! Esto es JamesTrade.'
+                case 'welcome_short':
+                    return '🤖 Comandos: /buy — pagar suscripción; SET KEY VALUE — cambiar ajuste.'
+    return None
@@ -7,11 +7,16 @@ JamesTrade — Главный запуск проекта
 """
 
 import sys
+import asyncio
 import subprocess
 import threading
 import time
 import os
 import importlib
+import importlib.util
+import hashlib
+import traceback
+from pathlib import Path
 
 # === 1. Кодировка ===
 try:
@@ -27,19 +32,38 @@ REQUIRED_LIBS = [
     "requests", "pandas", "numpy", "python-dotenv", "telebot", "ta"
 ]
 
-def install_missing():
-    missing = []
-    for lib in REQUIRED_LIBS:
-        try:
-            importlib.import_module(lib)
-        except ImportError:
-            missing.append(lib)
+# pip-имя -> имя модуля для импорта (где они различаются)
+_IMPORT_NAMES = {"python-dotenv": "dotenv"}
 
+def _probe(lib):
+    # find_spec только ищет модуль, не исполняя его — pandas не грузится
+    try:
+        return importlib.util.find_spec(_IMPORT_NAMES.get(lib, lib)) is not None
+    except (ImportError, ValueError):
+        return False
+
+def install_missing():
+    # stamp-файл: проверка уже проходила для этого набора библиотек и этой
+    # версии Python — пропускаем probe целиком на горячем пути запуска
+    digest = hashlib.blake2b(
+        repr(REQUIRED_LIBS).encode() + sys.version.encode(), digest_size=8
+    ).hexdigest()
+    stamp = Path(".deps_ok_" + digest)
+    if stamp.exists():
+        print("[Main] ✅ Зависимости проверены ранее")
+        return
+
+    missing = [lib for lib in REQUIRED_LIBS if not _probe(lib)]
     if missing:
         print(f"[Main] Устанавливаю зависимости: {missing}")
         subprocess.call([sys.executable, "-m", "pip", "install", *missing])
-    else:
+        missing = [lib for lib in REQUIRED_LIBS if not _probe(lib)]
+    if not missing:
         print("[Main] ✅ Все зависимости на месте")
+        try:
+            stamp.touch()
+        except OSError:
+            pass
 
 install_missing()
 
@@ -54,40 +78,49 @@ except:
 # Интервал для цикла торговли
 TRADING_LOOP_SEC = int(os.getenv("TRADING_LOOP_SEC", "60"))
 
-# === 4. Запуск торгового ядра ===
+# === 4. Запуск торгового ядра (in-process) ===
+# Вместо subprocess на каждый перезапуск: модуль импортируется один раз
+# (pandas/numpy инициализируются однажды), «рестарт» после падения — это
+# просто повторный вход в функцию через 5 сек.
 def run_trading_core():
+    core = None
     while True:
         try:
-            print("\n[Main] 🔥 Запуск trading_core.py ...")
-            subprocess.run([sys.executable, "trading_core.py", "loop", str(TRADING_LOOP_SEC)], check=True)
-        except:
+            if core is None:
+                core = importlib.import_module("trading_core")
+            print("\n[Main] 🔥 Запуск trading_core (in-process) ...")
+            core.loop(TRADING_LOOP_SEC)
+        except Exception:
+            traceback.print_exc()
             print("[Main] ⚠️ trading_core упал. Перезапуск через 5 сек...")
             time.sleep(5)
 
-# === 5. Запуск Telegram бота ===
+# === 5. Запуск Telegram бота (in-process, главный поток) ===
+# aiogram ставит signal-хендлеры — им нужен главный поток, поэтому торговое
+# ядро уходит в daemon-поток, а бот крутится здесь
 def run_tg_app():
+    bot_mod = None
     while True:
         try:
-            print("\n[Main] 💬 Запуск tg_app.py ...")
-            subprocess.run([sys.executable, "tg_app.py"], check=True)
-        except:
+            if bot_mod is None:
+                bot_mod = importlib.import_module("tg_app")
+            print("\n[Main] 💬 Запуск tg_app (in-process) ...")
+            asyncio.run(bot_mod.main())
+        except KeyboardInterrupt:
+            raise
+        except Exception:
+            traceback.print_exc()
             print("[Main] ⚠️ tg_app упал. Перезапуск через 5 сек...")
             time.sleep(5)
 
-# === 6. Запуск потоков ===
+# === 6. Запуск ===
 t1 = threading.Thread(target=run_trading_core, daemon=True)
-t2 = threading.Thread(target=run_tg_app, daemon=True)
-
 t1.start()
-t2.start()
 
 print("\n[Main] 🚀 Проект запущен — торговля + Telegram работают.")
 
-# === 7. Чтобы программа не завершалась ===
 try:
-    while True:
-        time.sleep(1)
+    run_tg_app()
 except KeyboardInterrupt:
     print("\n[Main] 📴 Остановка.")
-    sys.exit(0)
-''
\ No newline at end of file
+    sys.exit(0)
\ No newline at end of file
@@ -3,9 +3,12 @@
 # Python 3.11+, uses local client.py (Bybit) and db_json.py (if present).
 # Note: copy this file over your current trading_core.py
 
-import sys, os, time, json, math, logging, threading, traceback, requests
-from datetime import datetime
-from typing import Optional, Dict, Any
+import sys, os, re, time, json, math, hashlib, logging, threading, traceback, functools, queue, requests
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Optional, Dict, Any, Tuple
 
 # ensure utf-8 console
 try:
@@ -19,6 +22,9 @@ logger = logging.getLogger("trading_core")
 
 USERS_FILE = os.getenv("USERS_FILE", "./users.json")
 TRADES_FILE = os.getenv("TRADES_FILE", "./trades.json")
+# append-only журнал для file-fallback (без db_json): одна JSON-строка на
+# сделку — тот же формат и то же имя, что у db_json.TRADES_NDJSON
+TRADES_NDJSON = os.getenv("TRADES_NDJSON", os.path.splitext(TRADES_FILE)[0] + ".ndjson")
 LOCK = threading.Lock()
 
 # Telegram notify config (optional)
@@ -51,43 +57,175 @@ except Exception:
     np = None
     logger.warning("pandas/numpy missing — indicators need them to work properly.")
 
+# orjson (Rust) сериализует сразу в bytes и заметно быстрее stdlib именно на
+# float-полях (qty/price); при отсутствии — откат, как в db_json/tg_app
+try:
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
+def _dumps_compact(obj) -> str:
+    if _orjson is not None:
+        return _orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
 # ----------------- file helpers -----------------
 def _ensure_files():
     for path, default in [(USERS_FILE, {}), (TRADES_FILE, [])]:
         if not os.path.exists(path):
             os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(default, f, indent=4, ensure_ascii=False)
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(default, f, separators=(",", ":"), ensure_ascii=False)
+            os.replace(tmp, path)
+
+class UsersStore:
+    """Кэш users.json по ссылке: парсим один раз, дальше отдаём тот же dict,
+    перечитывая только когда stat файла сдвинулся (внешняя запись, например
+    из tg_app). Запись — атомарно через rename и только если payload реально
+    изменился (дайджест): save_users зовётся на каждый тик, а состояние
+    меняется редко."""
+
+    def __init__(self, path):
+        self.path = path
+        self._cache = None
+        self._stat = None
+        self._digest = None
+        self._lock = threading.Lock()
+
+    def _stat_now(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def get(self):
+        with self._lock:
+            st = self._stat_now()
+            if self._cache is not None and st == self._stat:
+                return self._cache
+            _ensure_files()
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._cache = json.load(f)
+            except Exception:
+                self._cache = {}
+            self._digest = None
+            self._stat = self._stat_now()
+            return self._cache
+
+    def save(self, data):
+        with self._lock:
+            try:
+                payload = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+                digest = hashlib.blake2b(payload.encode("utf-8"), digest_size=16).digest()
+                if digest == self._digest:
+                    return
+                tmp = self.path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(payload)
+                os.replace(tmp, self.path)
+                self._digest = digest
+                self._cache = data
+                self._stat = self._stat_now()
+            except Exception:
+                logger.exception("Failed save users.json")
+
+_USERS_STORE = UsersStore(USERS_FILE)
 
 def load_users_file():
-    _ensure_files()
-    try:
-        with open(USERS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
+    return _USERS_STORE.get()
 
 def save_users_file(data):
+    _USERS_STORE.save(data)
+
+# зеркало журнала в памяти: читатели получают готовый список без повторного
+# парса; инвалидация по stat() ловит запись из другого процесса
+_TRADES_MEM = None
+_TRADES_MEM_STAT = None
+
+def _stat_of(path):
     try:
-        with open(USERS_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
-    except Exception:
-        logger.exception("Failed save users.json")
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
 
-def append_trade_file(tr):
+# одноразовость миграции фиксируем флагом: после первого прохода горячие
+# пути не берут LOCK и не зовут os.path.exists на каждый вызов
+_NDJSON_READY = [False]
+
+def _ensure_ndjson():
+    if _NDJSON_READY[0]:
+        return
     with LOCK:
-        _ensure_files()
+        if not _NDJSON_READY[0]:
+            _migrate_trades_file_to_ndjson()
+            _NDJSON_READY[0] = True
+
+def _migrate_trades_file_to_ndjson():
+    """Одноразовая конверсия trades.json (массив) -> журнал. Вызывается под
+    LOCK; старый файл остаётся как бэкап."""
+    if os.path.exists(TRADES_NDJSON):
+        return
+    arr = []
+    if os.path.exists(TRADES_FILE):
         try:
             with open(TRADES_FILE, "r", encoding="utf-8") as f:
-                arr = json.load(f)
+                arr = json.load(f) or []
         except Exception:
             arr = []
-        arr.append(tr)
+    try:
+        tmp = TRADES_NDJSON + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for tr in arr:
+                f.write(_dumps_compact(tr) + "\n")
+        os.replace(tmp, TRADES_NDJSON)
+    except Exception:
+        logger.exception("trades.json -> ndjson migration failed")
+
+def append_trade_file(tr):
+    # Раньше каждая сделка стоила полный парс + полную перезапись массива с
+    # indent=4 (O(N) диска на запись). Журнал — это один append-write O(1).
+    # Сериализация — вне LOCK: критическая секция сжата до write + зеркало
+    global _TRADES_MEM_STAT
+    _ensure_ndjson()
+    line = _dumps_compact(tr) + "\n"
+    with LOCK:
         try:
-            with open(TRADES_FILE, "w", encoding="utf-8") as f:
-                json.dump(arr, f, indent=4, ensure_ascii=False)
+            with open(TRADES_NDJSON, "a", encoding="utf-8") as f:
+                f.write(line)
         except Exception:
-            logger.exception("Failed write trades.json")
+            logger.exception("Failed append to %s", TRADES_NDJSON)
+            return
+        if _TRADES_MEM is not None:
+            _TRADES_MEM.append(tr)
+            _TRADES_MEM_STAT = _stat_of(TRADES_NDJSON)
+
+def _read_trades_file():
+    # fast-path без LOCK: list.append атомарен под GIL, читатели видят либо
+    # зеркало до, либо после конкурентного append — оба снимка корректны
+    global _TRADES_MEM, _TRADES_MEM_STAT
+    _ensure_ndjson()
+    st = _stat_of(TRADES_NDJSON)
+    if _TRADES_MEM is not None and st == _TRADES_MEM_STAT:
+        return _TRADES_MEM
+    items = []
+    try:
+        with open(TRADES_NDJSON, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    items.append(json.loads(line))
+                except Exception:
+                    continue
+    except OSError:
+        items = []
+    _TRADES_MEM, _TRADES_MEM_STAT = items, st
+    return items
 
 def load_users():
     if db_mod and hasattr(db_mod, "load_users"):
@@ -101,8 +239,16 @@ def save_users(u):
 
 def append_trade(tr):
     if db_mod and hasattr(db_mod, "append_trade"):
-        return db_mod.append_trade(tr)
-    return append_trade_file(tr)
+        res = db_mod.append_trade(tr)
+    else:
+        res = append_trade_file(tr)
+    # инкрементально дополняем позиционный индекс и фиксируем новый stat
+    # журнала, чтобы собственная запись не выглядела «внешним» изменением
+    with LOCK:
+        if _POS_IDX_STAT[0] is not None:
+            _pos_idx_add(tr)
+            _POS_IDX_STAT[0] = _journal_stat()
+    return res
 
 # ----------------- util -----------------
 def mask_key(k):
@@ -111,18 +257,58 @@ def mask_key(k):
     s = str(k)
     return (s[:6] + "..." + s[-6:]) if len(s) > 12 else s
 
+# Уведомления — вне торгового пути: synchronous requests.post(timeout=8)
+# внутри цикла анализа добавлял до 8с на каждую сделку. Кладём в очередь,
+# её разгребает daemon-поток через Session с keep-alive пулом.
+_TG_Q = queue.Queue(maxsize=1000)
+_TG_SESS = None
+_TG_WORKER = [None]
+_TG_START_LOCK = threading.Lock()
+
+def _tg_session():
+    global _TG_SESS
+    if _TG_SESS is None:
+        s = requests.Session()
+        try:
+            from requests.adapters import HTTPAdapter
+            s.mount("https://", HTTPAdapter(pool_maxsize=8))
+        except Exception:
+            pass
+        _TG_SESS = s
+    return _TG_SESS
+
+def _tg_worker_loop():
+    while True:
+        chat_id, text = _TG_Q.get()
+        try:
+            url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+            payload = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
+            r = _tg_session().post(url, data=payload, timeout=8)
+            if r.status_code != 200:
+                logger.warning("Telegram send status %s for chat %s", r.status_code, chat_id)
+        except Exception:
+            logger.exception("Telegram send failed")
+        finally:
+            _TG_Q.task_done()
+
+def _start_tg_worker():
+    if _TG_WORKER[0] is None:
+        with _TG_START_LOCK:
+            if _TG_WORKER[0] is None:
+                t = threading.Thread(target=_tg_worker_loop, name="tg-notify", daemon=True)
+                t.start()
+                _TG_WORKER[0] = t
+
 def send_telegram_message(chat_id: str, text: str):
-    token = TELEGRAM_BOT_TOKEN
-    if not token or not chat_id:
+    if not TELEGRAM_BOT_TOKEN or not chat_id:
         return False
+    _start_tg_worker()
     try:
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
-        payload = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
-        r = requests.post(url, data=payload, timeout=8)
-        return r.status_code == 200
-    except Exception:
-        logger.exception("Telegram send failed")
+        _TG_Q.put_nowait((chat_id, text))
+    except queue.Full:
+        logger.warning("Telegram queue full, dropping message for chat %s", chat_id)
         return False
+    return True
 
 def notify_trade_to_user(user: dict, trade: dict):
     try:
@@ -152,10 +338,22 @@ def notify_trade_to_user(user: dict, trade: dict):
         return False
 
 # ----------------- symbol normalization -----------------
+_SYM_SPLIT_RE = re.compile(r"[;,]+")
+
+@functools.lru_cache(maxsize=256)
+def _normalize_symbols_str(raw: str) -> tuple:
+    # строковые SYMBOLS меняются редко — один regex-split на вариант,
+    # дальше из lru_cache
+    return tuple(p for p in (s.strip().upper() for s in _SYM_SPLIT_RE.split(raw)) if p)
+
 def _normalize_symbols(raw) -> list:
     if raw is None:
         return []
     if isinstance(raw, list):
+        # fast-path: список уже нормализован (обычный случай после первого
+        # прохода _ensure_user_defaults) — без пересборки
+        if all(isinstance(it, str) and it and it == it.strip() and it.isupper() for it in raw):
+            return raw
         out = []
         for it in raw:
             if not it:
@@ -165,8 +363,7 @@ def _normalize_symbols(raw) -> list:
                 out.append(s)
         return out
     if isinstance(raw, str):
-        parts = [p.strip().upper() for p in raw.replace(";", ",").split(",") if p.strip()]
-        return parts
+        return list(_normalize_symbols_str(raw))
     try:
         return [str(raw).strip().upper()]
     except Exception:
@@ -174,15 +371,22 @@ def _normalize_symbols(raw) -> list:
 
 # ----------------- ensure defaults -----------------
 def _ensure_user_defaults(users, uid):
+    """Дозаполняет дефолты. Возвращает True, если что-то реально менялось —
+    чтобы вызывающие сохраняли users.json только при изменениях, а не на
+    каждый тик."""
     uid = str(uid)
+    changed = False
     if uid not in users:
         users[uid] = {}
+        changed = True
     u = users[uid]
-    u.setdefault("username", f"user_{uid}")
-    u.setdefault("api_key", "")
-    u.setdefault("api_secret", "")
+    for k, v in (("username", f"user_{uid}"), ("api_key", ""), ("api_secret", "")):
+        if k not in u:
+            u[k] = v
+            changed = True
     if "settings" not in u or not isinstance(u["settings"], dict):
         u["settings"] = {}
+        changed = True
     s = u["settings"]
     defaults = {
         "USE_RSI": True, "RSI_PERIOD": 14, "RSI_OVERSOLD": 40, "RSI_OVERBOUGHT": 60,
@@ -203,7 +407,9 @@ def _ensure_user_defaults(users, uid):
         "TRADE_MODE": "mixed"  # options: mixed / spot_only / futures_only
     }
     for k, v in defaults.items():
-        s.setdefault(k, v)
+        if k not in s:
+            s[k] = v
+            changed = True
 
     # migrate lowercase "symbols"
     if "symbols" in s and "SYMBOLS" not in s:
@@ -214,19 +420,97 @@ def _ensure_user_defaults(users, uid):
             del s["symbols"]
         except Exception:
             pass
+        changed = True
 
     if isinstance(s.get("SYMBOLS"), str):
         s["SYMBOLS"] = _normalize_symbols(s.get("SYMBOLS"))
+        changed = True
     elif not isinstance(s.get("SYMBOLS"), list):
         s["SYMBOLS"] = defaults["SYMBOLS"][:]
+        changed = True
 
-    u.setdefault("_positions", {})
+    if "_positions" not in u:
+        u["_positions"] = {}
+        changed = True
     users[uid] = u
+    return changed
 
 # ----------------- indicators -----------------
+# numba опционален: с ним однопроходные ядра ниже компилируются в машинный
+# код (pandas ewm на каждом вызове создаёт несколько промежуточных Series);
+# без numba остаётся pandas-путь — чистый Python-цикл был бы медленнее
+# Cython-реализации ewm
+try:
+    from numba import njit
+    _HAS_NUMBA = True
+except Exception:
+    _HAS_NUMBA = False
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+@njit(cache=True, fastmath=True)
+def _ema_arr(arr, alpha):
+    out = np.empty(arr.size)
+    out[0] = arr[0]
+    for i in range(1, arr.size):
+        out[i] = alpha * arr[i] + (1.0 - alpha) * out[i - 1]
+    return out
+
+@njit(cache=True, fastmath=True)
+def _rsi_arr(arr, period):
+    # Wilder-сглаживание одним проходом; повторяет ewm(com=period-1,
+    # adjust=False) поверх diff().clip() с NaN в нулевой точке
+    n = arr.size
+    out = np.empty(n)
+    out[0] = np.nan
+    if n < 2:
+        return out
+    alpha = 1.0 / period
+    d = arr[1] - arr[0]
+    ma_up = d if d > 0.0 else 0.0
+    ma_down = -d if d < 0.0 else 0.0
+    out[1] = 100.0 - 100.0 / (1.0 + ma_up / (ma_down + 1e-12))
+    for i in range(2, n):
+        d = arr[i] - arr[i - 1]
+        up = d if d > 0.0 else 0.0
+        dn = -d if d < 0.0 else 0.0
+        ma_up = alpha * up + (1.0 - alpha) * ma_up
+        ma_down = alpha * dn + (1.0 - alpha) * ma_down
+        out[i] = 100.0 - 100.0 / (1.0 + ma_up / (ma_down + 1e-12))
+    return out
+
+@njit(cache=True, fastmath=True)
+def _macd_arrs(arr, fast, slow, signal):
+    n = arr.size
+    macd = np.empty(n)
+    sig = np.empty(n)
+    hist = np.empty(n)
+    af = 2.0 / (fast + 1.0)
+    aslow = 2.0 / (slow + 1.0)
+    ag = 2.0 / (signal + 1.0)
+    ef = arr[0]
+    es = arr[0]
+    macd[0] = 0.0
+    sig[0] = 0.0
+    hist[0] = 0.0
+    for i in range(1, n):
+        ef = af * arr[i] + (1.0 - af) * ef
+        es = aslow * arr[i] + (1.0 - aslow) * es
+        m = ef - es
+        s = ag * m + (1.0 - ag) * sig[i - 1]
+        macd[i] = m
+        sig[i] = s
+        hist[i] = m - s
+    return macd, sig, hist
+
 def rsi_series(close, period=14):
     if pd is None:
         raise RuntimeError("pandas required for indicators")
+    if _HAS_NUMBA:
+        arr = close.to_numpy(dtype=np.float64)
+        return pd.Series(_rsi_arr(arr, period), index=close.index)
     delta = close.diff()
     up = delta.clip(lower=0)
     down = -delta.clip(upper=0)
@@ -239,11 +523,20 @@ def rsi_series(close, period=14):
 def ema_series(close, period):
     if pd is None:
         raise RuntimeError("pandas required")
+    if _HAS_NUMBA:
+        arr = close.to_numpy(dtype=np.float64)
+        return pd.Series(_ema_arr(arr, 2.0 / (period + 1.0)), index=close.index)
     return close.ewm(span=period, adjust=False).mean()
 
 def macd_hist_series(close, fast=12, slow=26, signal=9):
     if pd is None:
         raise RuntimeError("pandas required")
+    if _HAS_NUMBA:
+        arr = close.to_numpy(dtype=np.float64)
+        macd, sig, hist = _macd_arrs(arr, float(fast), float(slow), float(signal))
+        return (pd.Series(macd, index=close.index),
+                pd.Series(sig, index=close.index),
+                pd.Series(hist, index=close.index))
     f = ema_series(close, fast)
     s = ema_series(close, slow)
     macd = f - s
@@ -251,6 +544,124 @@ def macd_hist_series(close, fast=12, slow=26, signal=9):
     hist = macd - sig
     return macd, sig, hist
 
+# ----- last-value variants -----
+# Торговой логике нужен только последний отсчёт каждого индикатора, а
+# *_series материализуют все N точек (плюс промежуточные массивы). Здесь те
+# же рекуррентности, но в скалярах — O(N) времени, O(1) памяти.
+@njit(cache=True, fastmath=True)
+def _ema_last(arr, alpha):
+    e = arr[0]
+    for i in range(1, arr.size):
+        e = alpha * arr[i] + (1.0 - alpha) * e
+    return e
+
+@njit(cache=True, fastmath=True)
+def _rsi_last(arr, period):
+    n = arr.size
+    if n < 2:
+        return np.nan
+    alpha = 1.0 / period
+    d = arr[1] - arr[0]
+    ma_up = d if d > 0.0 else 0.0
+    ma_down = -d if d < 0.0 else 0.0
+    for i in range(2, n):
+        d = arr[i] - arr[i - 1]
+        ma_up = alpha * (d if d > 0.0 else 0.0) + (1.0 - alpha) * ma_up
+        ma_down = alpha * (-d if d < 0.0 else 0.0) + (1.0 - alpha) * ma_down
+    return 100.0 - 100.0 / (1.0 + ma_up / (ma_down + 1e-12))
+
+@njit(cache=True, fastmath=True)
+def _macd_hist_last(arr, fast, slow, signal):
+    n = arr.size
+    af = 2.0 / (fast + 1.0)
+    aslow = 2.0 / (slow + 1.0)
+    ag = 2.0 / (signal + 1.0)
+    ef = arr[0]
+    es = arr[0]
+    m = 0.0
+    sig = 0.0
+    for i in range(1, n):
+        ef = af * arr[i] + (1.0 - af) * ef
+        es = aslow * arr[i] + (1.0 - aslow) * es
+        m = ef - es
+        sig = ag * m + (1.0 - ag) * sig
+    return m - sig
+
+@njit(cache=True, fastmath=True)
+def _signals_last(arr, rsi_period, ema_fast, ema_slow, macd_fast, macd_slow, macd_signal):
+    # Слияние трёх индикаторов в один проход: RSI/EMA/MACD — все рекурренты
+    # по одному и тому же массиву close, порознь это 3 прохода по памяти.
+    # Рекуррентности идентичны _rsi_last/_ema_last/_macd_hist_last.
+    n = arr.size
+    if n < 2:
+        return np.nan, arr[0] if n else np.nan, arr[0] if n else np.nan, 0.0
+    a_rsi = 1.0 / rsi_period
+    a_ef = 2.0 / (ema_fast + 1.0)
+    a_es = 2.0 / (ema_slow + 1.0)
+    a_mf = 2.0 / (macd_fast + 1.0)
+    a_ms = 2.0 / (macd_slow + 1.0)
+    a_sig = 2.0 / (macd_signal + 1.0)
+    ef = arr[0]
+    es = arr[0]
+    mf = arr[0]
+    ms = arr[0]
+    m = 0.0
+    sig = 0.0
+    ma_up = 0.0
+    ma_down = 0.0
+    for i in range(1, n):
+        x = arr[i]
+        ef = a_ef * x + (1.0 - a_ef) * ef
+        es = a_es * x + (1.0 - a_es) * es
+        mf = a_mf * x + (1.0 - a_mf) * mf
+        ms = a_ms * x + (1.0 - a_ms) * ms
+        m = mf - ms
+        sig = a_sig * m + (1.0 - a_sig) * sig
+        d = x - arr[i - 1]
+        up = d if d > 0.0 else 0.0
+        dn = -d if d < 0.0 else 0.0
+        if i == 1:
+            ma_up = up
+            ma_down = dn
+        else:
+            ma_up = a_rsi * up + (1.0 - a_rsi) * ma_up
+            ma_down = a_rsi * dn + (1.0 - a_rsi) * ma_down
+    rsi = 100.0 - 100.0 / (1.0 + ma_up / (ma_down + 1e-12))
+    return rsi, ef, es, m - sig
+
+def _as_f64(close):
+    if hasattr(close, "to_numpy"):
+        # copy=False: для уже-float64 колонки это view на буфер DataFrame,
+        # без аллокации (читаем, не пишем)
+        return close.to_numpy(dtype=np.float64, copy=False)
+    return np.asarray(close, dtype=np.float64)
+
+def rsi_last(close, period=14):
+    if np is None:
+        raise RuntimeError("numpy required for indicators")
+    return float(_rsi_last(_as_f64(close), period))
+
+def ema_last(close, period):
+    if np is None:
+        raise RuntimeError("numpy required")
+    return float(_ema_last(_as_f64(close), 2.0 / (period + 1.0)))
+
+def macd_hist_last(close, fast=12, slow=26, signal=9):
+    if np is None:
+        raise RuntimeError("numpy required")
+    return float(_macd_hist_last(_as_f64(close), float(fast), float(slow), float(signal)))
+
+def compute_signals_last(close, rsi_period=14, ema_fast=50, ema_slow=200,
+                         macd_fast=8, macd_slow=21, macd_signal=5):
+    """RSI + EMA(fast/slow) + MACD-hist за один проход по close.
+    Возвращает (rsi, ema_fast, ema_slow, macd_hist)."""
+    if np is None:
+        raise RuntimeError("numpy required for indicators")
+    r, ef, es, h = _signals_last(_as_f64(close), float(rsi_period),
+                                 float(ema_fast), float(ema_slow),
+                                 float(macd_fast), float(macd_slow), float(macd_signal))
+    return float(r), float(ef), float(es), float(h)
+
 # ----------------- client factory -----------------
 def make_client(api_key, api_secret, testnet):
     if client_mod and hasattr(client_mod, "BybitClient"):
@@ -260,6 +671,12 @@ def make_client(api_key, api_secret, testnet):
             logger.exception("Failed init local BybitClient — fallback")
 
     import requests as _requests, time as _time, hmac as _hmac, hashlib as _hashlib
+    from requests.adapters import HTTPAdapter as _HTTPAdapter
+    try:
+        from urllib3.util.retry import Retry as _Retry
+    except Exception:
+        _Retry = None
+
     class Fallback:
         def __init__(self, k, s, testnet):
             self.api_key = (k or "").strip()
@@ -267,10 +684,31 @@ def make_client(api_key, api_secret, testnet):
             self.testnet = bool(testnet)
             self.base = "https://api-testnet.bybit.com" if self.testnet else "https://api.bybit.com"
             self.sess = _requests.Session()
+            # пул keep-alive соединений + ретраи на 429/5xx: дефолтная сессия
+            # без настройки пересоздавала TCP+TLS, если соединение закрылось
+            # между минутными опросами
+            retries = (_Retry(total=2, backoff_factor=0.2,
+                              status_forcelist=[429, 500, 502, 503, 504])
+                       if _Retry is not None else 2)
+            _adapter = _HTTPAdapter(pool_connections=32, pool_maxsize=64,
+                                    max_retries=retries)
+            self.sess.mount("https://", _adapter)
+            self.sess.mount("http://", _adapter)
+            self.sess.headers.update({"Connection": "keep-alive"})
             self.recv_window = 10000
+            self._recv_str = str(self.recv_window)
             self._time_offset_ms = None
+            self._time_synced_at = None
+            # HMAC-шаблон с уже развёрнутым ключом: per-запрос остаётся только
+            # copy()+update() вместо повторного key-schedule в hmac.new()
+            self._hmac_tpl = _hmac.new(self.api_secret.encode(), b"", _hashlib.sha256)
 
         def _sync_server_time(self):
+            # один синк на сессию (ну или раз в 5 минут): повторные вызовы
+            # из retCode-путей не должны плодить лишние round-trip'ы
+            if (self._time_synced_at is not None
+                    and _time.monotonic() - self._time_synced_at < 300):
+                return True
             try:
                 url = ( "https://api-testnet.bybit.com" if self.testnet else "https://api.bybit.com" ) + "/v2/public/time"
                 r = self.sess.get(url, timeout=6)
@@ -289,6 +727,7 @@ def make_client(api_key, api_secret, testnet):
                     return False
                 local_ms = int(_time.time() * 1000)
                 self._time_offset_ms = server_ms - local_ms
+                self._time_synced_at = _time.monotonic()
                 logger.info("[Fallback] synced server time offset %d ms", self._time_offset_ms)
                 return True
             except Exception:
@@ -307,13 +746,15 @@ def make_client(api_key, api_secret, testnet):
         def _sign_headers(self, params_or_body=""):
             try:
                 ts = str(self._now_ms())
-                recv = str(self.recv_window)
+                recv = self._recv_str
                 if isinstance(params_or_body, dict):
                     param_str = "&".join(f"{k}={params_or_body[k]}" for k in sorted(params_or_body))
                 else:
                     param_str = str(params_or_body or "")
                 origin = ts + (self.api_key or "") + recv + param_str
-                sign = _hmac.new((self.api_secret or "").encode(), origin.encode(), _hashlib.sha256).hexdigest()
+                m = self._hmac_tpl.copy()
+                m.update(origin.encode())
+                sign = m.hexdigest()
                 return {
                     "X-BAPI-API-KEY": self.api_key,
                     "X-BAPI-TIMESTAMP": ts,
@@ -324,6 +765,17 @@ def make_client(api_key, api_secret, testnet):
                 logger.exception("Fallback._sign_headers exception")
                 return {}
 
+        def _maybe_update_offset(self, j):
+            # v5-ответы несут серверный timestamp в поле time — освежаем
+            # оффсет попутно, без отдельного похода в /v2/public/time
+            try:
+                server_ms = int(j.get("time") or 0)
+                if server_ms > 1_000_000_000_000:
+                    self._time_offset_ms = server_ms - int(_time.time() * 1000)
+                    self._time_synced_at = _time.monotonic()
+            except Exception:
+                pass
+
         def _get(self, path, params=None, auth=False):
             url = self.base + path
             try:
@@ -333,7 +785,10 @@ def make_client(api_key, api_secret, testnet):
                 else:
                     r = self.sess.get(url, params=params, timeout=12)
                 try:
-                    return r.json()
+                    j = r.json()
+                    if isinstance(j, dict):
+                        self._maybe_update_offset(j)
+                    return j
                 except Exception:
                     logger.warning("Fallback._get: json decode failed, status=%s", r.status_code)
                     return {"retCode": -1, "retMsg": f"json decode failed status={r.status_code}"}
@@ -407,86 +862,155 @@ def make_client(api_key, api_secret, testnet):
     return Fallback(api_key, api_secret, testnet)
 
 # ----------------- helpers for qty/position detection -----------------
+# степени десятки один раз на модуль, не 10**prec на каждый ордер
+_POW10 = [10 ** i for i in range(13)]
+
 def floor_qty(q, prec):
     try:
         if q <= 0:
             return 0.0
-        f = 10 ** int(prec)
-        return math.floor(float(q) * f) / f
+        prec = int(prec)
+        f = _POW10[prec] if 0 <= prec < len(_POW10) else 10 ** prec
+        # Decimal(str(q)) берёт краткое repr-представление float, поэтому
+        # 0.07*3=0.21000000000000002 не под-флорится до 0.2099... как при
+        # floor(q*f)/f — биржа такой qty не отвергнет
+        return float(int(Decimal(str(q)) * f)) / f
     except Exception:
         return 0.0
 
 def read_trades():
-    _ensure_files()
+    if db_mod and hasattr(db_mod, "load_trades"):
+        try:
+            return db_mod.load_trades()
+        except Exception:
+            logger.exception("db_json.load_trades failed — fallback to file")
+    return _read_trades_file()
+
+# ----------------- incremental position index -----------------
+# Последние open/close сделки по (uid, symbol, market_type): строится один
+# раз из журнала и дальше дополняется append_trade'ом. Проверки позиций
+# были O(|всех сделок|) на каждый символ каждого пользователя каждый тик
+# (полный парс журнала × 3 хелпера) — теперь O(1) lookup без I/O.
+_POS_IDX: Dict[tuple, Dict[str, dict]] = {}
+_POS_IDX_STAT = [None]  # (mtime_ns, size) журнала на момент построения
+
+def _journal_path():
+    if db_mod is not None:
+        p = getattr(db_mod, "TRADES_NDJSON", None)
+        if p:
+            return p
+    return TRADES_NDJSON
+
+def _journal_stat():
     try:
-        with open(TRADES_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return []
+        st = os.stat(_journal_path())
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return (0, 0)
 
-def has_open_spot(user_id, symbol):
-    trades = read_trades()
-    last_buy = None
-    last_sell = None
-    for t in trades:
-        if str(t.get("user_id")) != str(user_id):
-            continue
-        if t.get("symbol") != symbol:
-            continue
-        if t.get("market_type") != "spot":
-            continue
-        side = (t.get("side") or "").lower()
-        if side == "buy":
-            last_buy = t
-        if side == "sell":
-            last_sell = t
-    if last_buy and (not last_sell or last_buy.get("timestamp") > last_sell.get("timestamp")):
-        return last_buy
-    return None
+def _pos_idx_add(t):
+    if not isinstance(t, dict):
+        return
+    mkt = t.get("market_type")
+    side = (t.get("side") or "").lower()
+    action = t.get("action", "")
+    if mkt == "spot":
+        slot = side if side in ("buy", "sell") else None
+    elif mkt == "futures":
+        # open short = Sell/open, close short = Buy/close; long — зеркально
+        slot = {
+            ("sell", "open"): "open_short", ("buy", "close"): "close_short",
+            ("buy", "open"): "open_long", ("sell", "close"): "close_long",
+        }.get((side, action))
+    else:
+        slot = None
+    if slot is None:
+        return
+    key = (str(t.get("user_id")), t.get("symbol"), mkt)
+    _POS_IDX.setdefault(key, {})[slot] = t
 
-def has_open_futures_short(user_id, symbol):
+def _ensure_pos_idx():
+    """Ленивая постройка индекса + перестройка, если журнал менялся извне
+    (mtime/size отличаются от зафиксированных при последней записи)."""
+    st = _journal_stat()
+    with LOCK:
+        if _POS_IDX_STAT[0] == st:
+            return
+    # сам парс — вне LOCK: read_trades берёт его внутри для миграции
     trades = read_trades()
-    last_open = None
-    last_close = None
-    for t in trades:
-        if str(t.get("user_id")) != str(user_id):
-            continue
-        if t.get("symbol") != symbol:
-            continue
-        if t.get("market_type") != "futures":
-            continue
-        side = (t.get("side") or "").lower()
-        # open short recorded as side="Sell" and action="open"
-        if side == "sell" and t.get("action","") == "open":
-            last_open = t
-        if side == "buy" and t.get("action","") == "close":
-            last_close = t
+    with LOCK:
+        _POS_IDX.clear()
+        for t in trades:
+            _pos_idx_add(t)
+        _POS_IDX_STAT[0] = st
+
+def _pos_lookup(user_id, symbol, market_type, open_slot, close_slot):
+    _ensure_pos_idx()
+    entry = _POS_IDX.get((str(user_id), symbol, market_type))
+    if not entry:
+        return None
+    last_open = entry.get(open_slot)
+    last_close = entry.get(close_slot)
     if last_open and (not last_close or last_open.get("timestamp") > last_close.get("timestamp")):
         return last_open
     return None
 
+def has_open_spot(user_id, symbol):
+    return _pos_lookup(user_id, symbol, "spot", "buy", "sell")
+
+def has_open_futures_short(user_id, symbol):
+    return _pos_lookup(user_id, symbol, "futures", "open_short", "close_short")
+
 def has_open_futures_long(user_id, symbol):
-    trades = read_trades()
-    last_open = None
-    last_close = None
-    for t in trades:
-        if str(t.get("user_id")) != str(user_id):
-            continue
-        if t.get("symbol") != symbol:
-            continue
-        if t.get("market_type") != "futures":
-            continue
-        side = (t.get("side") or "").lower()
-        # open long recorded as side="Buy" and action="open"
-        if side == "buy" and t.get("action","") == "open":
-            last_open = t
-        if side == "sell" and t.get("action","") == "close":
-            last_close = t
-    if last_open and (not last_close or last_open.get("timestamp") > last_close.get("timestamp")):
-        return last_open
-    return None
+    return _pos_lookup(user_id, symbol, "futures", "open_long", "close_long")
 
 # ----------------- normalize OHLCV to DataFrame -----------------
+_OHLCV_TS_KEYS = ("t", "startTime", "time", "timestamp", "start_at")
+_OHLCV_COL_KEYS = {
+    "open": ("o", "open", "openPrice"),
+    "high": ("h", "high", "highPrice"),
+    "low": ("l", "low", "lowPrice"),
+    "close": ("c", "close", "closePrice"),
+    "volume": ("v", "volume", "vol"),
+}
+
+def _normalize_items_fast(items):
+    """Векторная сборка DataFrame: ключи определяются один раз по первому
+    элементу, колонки собираются np.fromiter'ом вместо питоновского
+    row-by-row цикла с цепочками .get(). Возвращает None при нестандартной
+    форме данных — тогда отрабатывает универсальный путь ниже."""
+    if pd is None or np is None or not items:
+        return None
+    first = items[0]
+    n = len(items)
+    try:
+        if isinstance(first, dict):
+            tk = next((k for k in _OHLCV_TS_KEYS if k in first), None)
+            if tk is None:
+                return None
+            cols = {}
+            for name, aliases in _OHLCV_COL_KEYS.items():
+                k = next((a for a in aliases if a in first), None)
+                if k is None:
+                    return None
+                cols[name] = np.fromiter((float(it[k]) for it in items),
+                                         dtype=np.float64, count=n)
+            ts = np.fromiter((float(it[tk]) for it in items),
+                             dtype=np.float64, count=n)
+        elif isinstance(first, (list, tuple)) and len(first) >= 6:
+            a = np.array([it[:6] for it in items], dtype=np.float64)
+            ts = a[:, 0]
+            cols = {name: a[:, i] for i, name in
+                    enumerate(("open", "high", "low", "close", "volume"), start=1)}
+        else:
+            return None
+        idx = pd.to_datetime(ts.astype(np.int64), unit="ms", utc=True)
+        df = pd.DataFrame(cols, index=idx)
+        df.index.name = "t"
+        return df.sort_index()
+    except (TypeError, ValueError, KeyError):
+        return None
+
 def normalize_ohlcv(raw):
     if raw is None:
         return None
@@ -520,6 +1044,9 @@ def normalize_ohlcv(raw):
             return None
     if not items or len(items) == 0:
         return None
+    df = _normalize_items_fast(items)
+    if df is not None:
+        return df
     rows = []
     for it in items:
         if isinstance(it, dict):
@@ -546,14 +1073,502 @@ def normalize_ohlcv(raw):
     df = df.dropna(subset=["t"]).set_index("t").sort_index()
     return df
 
+# ----------------- shared OHLCV cache -----------------
+# Kline-эндпоинт публичный и не зависит от api_key: один и тот же
+# symbol+timeframe раньше скачивался и нормализовывался заново для каждого
+# пользователя. Кэшируем готовый DataFrame на ~полсвечи и ходим за ним
+# одним общим неавторизованным клиентом — HTTP и парс становятся O(симв.),
+# а не O(польз.×симв.) за тик
+_OHLCV_CACHE: Dict[tuple, tuple] = {}
+_OHLCV_LOCK = threading.Lock()
+_PUBLIC_CLIENTS: Dict[bool, Any] = {}
+
+def _tf_seconds(timeframe):
+    try:
+        return int(timeframe) * 60
+    except (TypeError, ValueError):
+        return {"D": 86400, "W": 604800, "M": 2592000}.get(str(timeframe).upper(), 300)
+
+def _public_client(testnet):
+    testnet = bool(testnet)
+    with _OHLCV_LOCK:
+        c = _PUBLIC_CLIENTS.get(testnet)
+        if c is None:
+            c = make_client("", "", testnet)
+            _PUBLIC_CLIENTS[testnet] = c
+        return c
+
+def _get_ohlcv_df(symbol, timeframe, testnet, limit=200):
+    key = (symbol, str(timeframe), bool(testnet))
+    ttl = max(5.0, _tf_seconds(timeframe) / 2.0)
+    now = time.monotonic()
+    with _OHLCV_LOCK:
+        hit = _OHLCV_CACHE.get(key)
+        if hit is not None and now - hit[0] < ttl:
+            return hit[1]
+    c = _public_client(testnet)
+    raw = c.fetch_ohlcv(symbol, interval=str(timeframe), limit=limit) if hasattr(c, "fetch_ohlcv") else None
+    df = normalize_ohlcv(raw)
+    if df is None or (pd is not None and hasattr(df, "empty") and df.empty):
+        # неудачный фетч не кэшируем — следующий вызов попробует снова
+        return None
+    with _OHLCV_LOCK:
+        _OHLCV_CACHE[key] = (time.monotonic(), df)
+    return df
+
+# «Скомпилированные» настройки: все int()/float()/bool()-конверсии и
+# нормализация символов выполняются один раз на вариант настроек, а не на
+# каждый символ каждого тика. Ключ кэша — каноничный JSON settings-словаря
+def _to_int(v, d):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return d
+
+def _to_float(v, d):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return d
+
+@dataclass(frozen=True)
+class CompiledSettings:
+    use_rsi: bool
+    rsi_period: int
+    rsi_oversold: float
+    rsi_overbought: float
+    use_ema: bool
+    fast_ma: int
+    slow_ma: int
+    use_macd: bool
+    macd_fast: int
+    macd_slow: int
+    macd_signal: int
+    use_oi: bool
+    oi_min_change_pct: float
+    buy_thr: float
+    sell_thr: float
+    order_usd: float
+    order_pct: float
+    qty_prec: int
+    min_notional: float
+    default_leverage: int
+    dry_run: bool
+    enable_shorts: bool
+    symbols: Tuple[str, ...]
+    timeframe: str
+    trade_mode: str
+    testnet: bool
+
+_CS_CACHE: Dict[str, CompiledSettings] = {}
+
+def compile_settings(settings) -> CompiledSettings:
+    sig = json.dumps(settings, sort_keys=True, default=str)
+    cs = _CS_CACHE.get(sig)
+    if cs is not None:
+        return cs
+    cs = CompiledSettings(
+        use_rsi=bool(settings.get("USE_RSI", True)),
+        rsi_period=_to_int(settings.get("RSI_PERIOD", 14), 14),
+        rsi_oversold=_to_float(settings.get("RSI_OVERSOLD", 40), 40.0),
+        rsi_overbought=_to_float(settings.get("RSI_OVERBOUGHT", 60), 60.0),
+        use_ema=bool(settings.get("USE_EMA", True)),
+        fast_ma=_to_int(settings.get("FAST_MA", 50), 50),
+        slow_ma=_to_int(settings.get("SLOW_MA", 200), 200),
+        use_macd=bool(settings.get("USE_MACD", True)),
+        macd_fast=_to_int(settings.get("MACD_FAST", 8), 8),
+        macd_slow=_to_int(settings.get("MACD_SLOW", 21), 21),
+        macd_signal=_to_int(settings.get("MACD_SIGNAL", 5), 5),
+        use_oi=bool(settings.get("USE_OI", False)),
+        oi_min_change_pct=_to_float(settings.get("OI_MIN_CHANGE_PCT", 5.0), 5.0),
+        buy_thr=_to_float(settings.get("BUY_CONFIRMATION_RATIO", 0.66), 0.66),
+        sell_thr=_to_float(settings.get("SELL_CONFIRMATION_RATIO", 0.33), 0.33),
+        order_usd=_to_float(settings.get("ORDER_SIZE_USD", 0.0) or 0.0, 0.0),
+        order_pct=_to_float(settings.get("ORDER_PERCENT", 10.0), 10.0),
+        qty_prec=_to_int(settings.get("QTY_PRECISION", 6), 6),
+        min_notional=_to_float(settings.get("MIN_NOTIONAL", 5.0), 5.0),
+        default_leverage=_to_int(settings.get("DEFAULT_LEVERAGE", 3), 3),
+        dry_run=bool(settings.get("DRY_RUN", False)),
+        enable_shorts=bool(settings.get("ENABLE_SHORTS", True)),
+        symbols=tuple(_normalize_symbols(settings.get("SYMBOLS") or settings.get("symbols"))),
+        timeframe=str(settings.get("TIMEFRAME", "5")),
+        trade_mode=str(settings.get("TRADE_MODE", "mixed")).lower(),
+        testnet=bool(settings.get("TESTNET", True)),
+    )
+    if len(_CS_CACHE) > 512:
+        _CS_CACHE.clear()
+    _CS_CACHE[sig] = cs
+    return cs
+
+def _sized_order(order_usd, price, qty_prec, min_notional):
+    """Количество для ордера на order_usd по цене price с биржевым floor.
+    Возвращает 0.0, если цена невалидна или ордер меньше min_notional —
+    одна точка для сайзинга вместо трёх строк в каждой ветке."""
+    if price <= 0:
+        return 0.0
+    qty = floor_qty(order_usd / price, qty_prec)
+    if qty * price < min_notional:
+        return 0.0
+    return qty
+
+# Клиент пересоздавался на каждого пользователя каждый цикл — вместе с ним
+# умирал и keep-alive пул его requests.Session, так что каждый цикл платил
+# TLS-рукопожатие заново. Держим клиентов между циклами с TTL; смена
+# API-ключей меняет ключ кэша (дайджест), старая запись просто протухает.
+_CLIENT_POOL: Dict[tuple, tuple] = {}
+_CLIENT_POOL_LOCK = threading.Lock()
+_CLIENT_TTL = int(os.getenv("CLIENT_TTL_SEC", "900"))
+
+def _pooled_client(uid, api_key, api_secret, testnet):
+    key = (str(uid), bool(testnet),
+           hashlib.blake2b(f"{api_key}\x00{api_secret}".encode(), digest_size=8).digest())
+    now = time.time()
+    with _CLIENT_POOL_LOCK:
+        ent = _CLIENT_POOL.get(key)
+        if ent is not None and now < ent[1]:
+            return ent[0]
+    c = make_client(api_key, api_secret, testnet)
+    with _CLIENT_POOL_LOCK:
+        if len(_CLIENT_POOL) > 256:
+            for k in [k for k, v in _CLIENT_POOL.items() if now >= v[1]]:
+                _CLIENT_POOL.pop(k, None)
+        _CLIENT_POOL[key] = (c, now + _CLIENT_TTL)
+    return c
+
+# set_leverage — полноценный REST round-trip, а плечо у пользователя меняется
+# редко: дёргаем биржу только когда закэшированное значение разошлось.
+# Живёт на уровне модуля — переживает циклы run_once в loop-режиме.
+_LEV_CACHE: Dict[Tuple[str, str], int] = {}
+
+def _ensure_leverage(c, uid, symbol, lev):
+    key = (str(uid), symbol)
+    if _LEV_CACHE.get(key) == lev or not hasattr(c, "set_leverage"):
+        return
+    try:
+        c.set_leverage(symbol, lev)
+        _LEV_CACHE[key] = lev
+    except Exception:
+        logger.debug("set_leverage failed or not supported")
+
+def _emit_trade(uid, user, symbol, market, side, qty, price, ts, *,
+                dry, action=None, leverage=None, result=None):
+    """Единая точка записи сделки: собирает tr-словарь, журналирует и шлёт
+    уведомление — вместо восьми одинаковых dict-литералов по веткам."""
+    tr = {"user_id": uid, "symbol": symbol, "market_type": market, "side": side,
+          "qty": qty, "price": price, "timestamp": ts}
+    if action is not None:
+        tr["action"] = action
+    if leverage is not None:
+        tr["leverage"] = leverage
+    if dry:
+        tr["dry"] = True
+    else:
+        tr["result"] = result
+    append_trade(tr)
+    notify_trade_to_user(user, tr)
+    return tr
+
+def _analyze_symbol(uid, user, cs, c, balance_usd, symbol):
+    """Анализ и торговля по одному символу — тело бывшего цикла
+    for symbol in symbols, вынесенное для параллельного запуска."""
+    # уровень известен на входе: дешёвый локальный bool вместо резолва
+    # логгера и прохода по хендлерам на каждый hot-path info
+    log_info = logger.isEnabledFor(logging.INFO)
+    # способности клиента стабильны на всё время его жизни — один hasattr
+    # на вызов вместо try/except AttributeError в каждой ветке
+    has_oi = hasattr(c, "fetch_open_interest")
+    has_spot = hasattr(c, "place_spot_order")
+    timeframe = cs.timeframe
+    trade_mode = cs.trade_mode
+    testnet = cs.testnet
+    try:
+        if log_info:
+            logger.info("User %s symbol %s fetching ohlcv", uid, symbol)
+        df = _get_ohlcv_df(symbol, timeframe, testnet)
+        if df is None or (pd is not None and df.empty):
+            logger.warning("No ohlcv for %s %s (fetch/normalize returned None/empty)", uid, symbol)
+            return
+        close_np = _as_f64(df["close"]) if np is not None else df["close"]
+        # короткая история: рекуррентам нужно хотя бы max(period)+2 баров,
+        # иначе «сигналы» — это шум на недопрогретых EMA
+        if np is not None and close_np.size < max(cs.slow_ma, cs.macd_slow, cs.rsi_period) + 2:
+            if log_info:
+                logger.info("Not enough bars for %s %s: %d", uid, symbol, close_np.size)
+            return
+
+        # indicators & votes: голые int-счётчики вместо dict — bool сложением,
+        # без веток и хеш-лукапов на каждый голос
+        buy_votes = 0
+        sell_votes = 0
+        active = 0
+        indicators = {}
+
+        # один fused-проход по close считает все три индикатора; флаги use_*
+        # гейтят только голоса — сам расчёт после слияния почти бесплатный
+        if cs.use_rsi or cs.use_ema or cs.use_macd:
+            try:
+                lr, lf, ls, hlast = compute_signals_last(
+                    close_np, rsi_period=cs.rsi_period,
+                    ema_fast=cs.fast_ma, ema_slow=cs.slow_ma,
+                    macd_fast=cs.macd_fast, macd_slow=cs.macd_slow,
+                    macd_signal=cs.macd_signal)
+                if cs.use_rsi:
+                    indicators["rsi"]=lr
+                    os_hit = lr <= cs.rsi_oversold
+                    buy_votes += os_hit
+                    sell_votes += (not os_hit) and lr >= cs.rsi_overbought
+                    active+=1
+                if cs.use_ema:
+                    indicators["ema_fast"]=lf
+                    indicators["ema_slow"]=ls
+                    up = lf > ls
+                    buy_votes += up
+                    sell_votes += not up
+                    active+=1
+                if cs.use_macd:
+                    indicators["macd_hist"]=hlast
+                    up = hlast > 0
+                    buy_votes += up
+                    sell_votes += not up
+                    active+=1
+            except Exception:
+                logger.exception("RSI/EMA/MACD fail")
+
+        if cs.use_oi:
+            try:
+                oi_raw = c.fetch_open_interest(symbol, interval=timeframe, limit=50) if has_oi else None
+                if oi_raw and isinstance(oi_raw, dict):
+                    res = oi_raw.get("result") or {}
+                    lst = res.get("list") or []
+                    if pd is not None and lst:
+                        srs = []
+                        for it in lst:
+                            val = it.get("open_interest") or it.get("oi") or it.get("openInterest")
+                            srs.append(float(val or 0))
+                        if len(srs) >= 2:
+                            pct = (srs[-1]-srs[0]) / max(srs[0],1e-9) * 100.0
+                            indicators["oi_pct"]=pct
+                            oi_up = pct >= cs.oi_min_change_pct
+                            buy_votes += oi_up
+                            sell_votes += (not oi_up) and pct <= -cs.oi_min_change_pct
+                            active+=1
+            except Exception:
+                logger.exception("OI fail")
+
+        if active == 0:
+            if log_info:
+                logger.info("No active indicators for %s %s", uid, symbol)
+            return
+
+        buy_ratio = buy_votes/active
+        sell_ratio = sell_votes/active
+        if log_info:
+            logger.info("User %s %s votes buy=%d sell=%d active %d buy_ratio %.2f sell_ratio %.2f", uid, symbol, buy_votes, sell_votes, active, buy_ratio, sell_ratio)
+
+        # классифицируем сигнал один раз: дальше ветки сравнивают готовые
+        # bool'ы, а не пересчитывают ratio>=threshold по 4 раза. Заметим, что
+        # при дефолтных порогах (0.66/0.33) buy и sell могут сработать в одном
+        # проходе — поэтому это именно два флага, а не взаимоисключающий elif
+        buy_sig = buy_ratio >= cs.buy_thr
+        sell_sig = sell_ratio >= cs.sell_thr
+        # нет сигнала — нет работы: без этого выхода символ всё равно прошёл
+        # бы все проверки позиций и веток, чтобы ничего не сделать
+        if not (buy_sig or sell_sig):
+            return
+
+        # positions detection:
+        spot_pos = has_open_spot(uid, symbol)
+        short_pos = has_open_futures_short(uid, symbol)
+        long_pos = has_open_futures_long(uid, symbol)
+
+        # close_np[-1] вместо close.iloc[-1]: без pandas label->position
+        # диспатча — последняя pandas-операция в горячем пути
+        price = float(close_np[-1])
+        timestamp = datetime.fromtimestamp(time.time(), tz=timezone.utc).isoformat()
+
+        # determine order USD size (считается лениво и один раз на символ,
+        # сколько бы веток его ни запросило)
+        _order_usd_memo = []
+        def compute_order_usd():
+            if not _order_usd_memo:
+                order_usd = cs.order_usd
+                if order_usd <= 0:
+                    order_usd = balance_usd * (cs.order_pct/100.0)
+                _order_usd_memo.append(order_usd)
+            return _order_usd_memo[0]
+
+        # Helper to place futures order with long/short semantics depending on reduce_only flag
+        def place_futures_open(side, qty, lev):
+            _ensure_leverage(c, uid, symbol, lev)
+            return c.place_futures_order(side, qty, symbol, leverage=lev, reduce_only=False)
+
+        def place_futures_close(side, qty, lev):
+            # close uses reduce_only True and side is the closing side (Buy to close short, Sell to close long)
+            return c.place_futures_order(side, qty, symbol, leverage=lev, reduce_only=True)
+
+        # ----------------- Trading behavior by TRADE_MODE -----------------
+        if trade_mode == "futures_only":
+            # Use futures for BOTH long and short
+            # BUY signal -> close short if exists else open long
+            if buy_sig:
+                order_usd = compute_order_usd()
+                if order_usd <= 0:
+                    logger.warning("No capital for user %s", uid)
+                else:
+                    qty = _sized_order(order_usd, price, cs.qty_prec, cs.min_notional)
+                    if not qty:
+                        logger.warning("Order below min notional for %s", uid)
+                    else:
+                        lev = cs.default_leverage
+                        dry = cs.dry_run
+                        if short_pos:
+                            # close short: buy reduce_only
+                            if dry:
+                                if log_info:
+                                    logger.info("[DRY] FUTURES CLOSE SHORT (buy) user %s %s qty=%.8f price=%.2f", uid, symbol, qty, price)
+                                _emit_trade(uid, user, symbol, "futures", "Buy", qty, price, timestamp, dry=True, action="close")
+                            else:
+                                res = place_futures_close("Buy", qty, lev)
+                                if log_info:
+                                    logger.info("Futures close short res: %s", res)
+                                _emit_trade(uid, user, symbol, "futures", "Buy", qty, price, timestamp, dry=False, action="close", result=res)
+                        else:
+                            # open long: buy open
+                            if dry:
+                                if log_info:
+                                    logger.info("[DRY] FUTURES OPEN LONG (buy) user %s %s qty=%.8f price=%.2f lev=%d", uid, symbol, qty, price, lev)
+                                _emit_trade(uid, user, symbol, "futures", "Buy", qty, price, timestamp, dry=True, action="open", leverage=lev)
+                            else:
+                                res = place_futures_open("Buy", qty, lev)
+                                if log_info:
+                                    logger.info("Futures open long res: %s", res)
+                                _emit_trade(uid, user, symbol, "futures", "Buy", qty, price, timestamp, dry=False, action="open", leverage=lev, result=res)
+
+            # SELL signal -> close long if exists else open short
+            if sell_sig:
+                order_usd = compute_order_usd()
+                if order_usd <= 0:
+                    logger.warning("No capital for user %s", uid)
+                else:
+                    qty = _sized_order(order_usd, price, cs.qty_prec, cs.min_notional)
+                    if not qty:
+                        logger.warning("Order below min notional for %s", uid)
+                    else:
+                        lev = cs.default_leverage
+                        dry = cs.dry_run
+                        if long_pos:
+                            # close long: sell reduce_only
+                            if dry:
+                                if log_info:
+                                    logger.info("[DRY] FUTURES CLOSE LONG (sell) user %s %s qty=%.8f price=%.2f", uid, symbol, qty, price)
+                                _emit_trade(uid, user, symbol, "futures", "Sell", qty, price, timestamp, dry=True, action="close")
+                            else:
+                                res = place_futures_close("Sell", qty, lev)
+                                if log_info:
+                                    logger.info("Futures close long res: %s", res)
+                                _emit_trade(uid, user, symbol, "futures", "Sell", qty, price, timestamp, dry=False, action="close", result=res)
+                        else:
+                            # open short: sell open
+                            if dry:
+                                if log_info:
+                                    logger.info("[DRY] FUTURES OPEN SHORT user %s %s qty=%.8f price=%.2f lev=%d", uid, symbol, qty, price, lev)
+                                _emit_trade(uid, user, symbol, "futures", "Sell", qty, price, timestamp, dry=True, action="open", leverage=lev)
+                            else:
+                                res = place_futures_open("Sell", qty, lev)
+                                if log_info:
+                                    logger.info("Futures open short res: %s", res)
+                                _emit_trade(uid, user, symbol, "futures", "Sell", qty, price, timestamp, dry=False, action="open", leverage=lev, result=res)
+
+        else:
+            # MIXED or SPOT_ONLY behavior (existing logic)
+            # BUY -> spot buy (unless TRADE_MODE == spot_only then same); if you want buy via futures for mixed, change config
+            if buy_sig and not spot_pos:
+                order_usd = compute_order_usd()
+                if order_usd <= 0:
+                    logger.warning("No capital for user %s", uid)
+                else:
+                    qty = _sized_order(order_usd, price, cs.qty_prec, cs.min_notional)
+                    if not qty:
+                        logger.warning("Order below min notional for %s", uid)
+                    else:
+                        dry = cs.dry_run
+                        if dry:
+                            if log_info:
+                                logger.info("[DRY] Spot BUY user %s %s qty=%.8f price=%.2f", uid, symbol, qty, price)
+                            _emit_trade(uid, user, symbol, "spot", "Buy", qty, price, timestamp, dry=True)
+                        else:
+                            res = c.place_spot_order("Buy", qty, symbol) if has_spot else None
+                            if log_info:
+                                logger.info("Spot buy result: %s", res)
+                            _emit_trade(uid, user, symbol, "spot", "Buy", qty, price, timestamp, dry=False, result=res)
+
+            # CLOSE SPOT
+            if sell_sig and spot_pos:
+                qty = float(spot_pos.get("qty",0) or 0)
+                if qty <= 0:
+                    logger.warning("Cannot determine spot qty to close for %s", uid)
+                else:
+                    dry = cs.dry_run
+                    if dry:
+                        if log_info:
+                            logger.info("[DRY] Spot SELL (close) user %s %s qty=%.8f price=%.2f", uid, symbol, qty, price)
+                        _emit_trade(uid, user, symbol, "spot", "Sell", qty, price, timestamp, dry=True)
+                    else:
+                        res = c.place_spot_order("Sell", qty, symbol)
+                        if log_info:
+                            logger.info("Spot sell result: %s", res)
+                        _emit_trade(uid, user, symbol, "spot", "Sell", qty, price, timestamp, dry=False, result=res)
+
+            # SHORTS via futures (same as before)
+            if sell_sig and cs.enable_shorts and not short_pos:
+                order_usd = compute_order_usd()
+                if order_usd <= 0:
+                    logger.warning("No capital for futures short user %s", uid)
+                else:
+                    lev = cs.default_leverage
+                    qty = _sized_order(order_usd, price, cs.qty_prec, cs.min_notional)
+                    if not qty:
+                        logger.warning("Futures order below min notional for %s", uid)
+                    else:
+                        dry = cs.dry_run
+                        if dry:
+                            if log_info:
+                                logger.info("[DRY] FUTURES OPEN SHORT user %s %s qty=%.8f price=%.2f lev=%d", uid, symbol, qty, price, lev)
+                            _emit_trade(uid, user, symbol, "futures", "Sell", qty, price, timestamp, dry=True, action="open", leverage=lev)
+                        else:
+                            _ensure_leverage(c, uid, symbol, lev)
+                            res = c.place_futures_order("Sell", qty, symbol, leverage=lev, reduce_only=False)
+                            if log_info:
+                                logger.info("Futures open short res: %s", res)
+                            _emit_trade(uid, user, symbol, "futures", "Sell", qty, price, timestamp, dry=False, action="open", leverage=lev, result=res)
+
+            # CLOSE SHORT (buy to close)
+            if buy_sig and short_pos:
+                qty = float(short_pos.get("qty",0) or 0)
+                if qty <= 0:
+                    logger.warning("Cannot determine futures qty to close for %s", uid)
+                else:
+                    dry = cs.dry_run
+                    if dry:
+                        if log_info:
+                            logger.info("[DRY] FUTURES CLOSE SHORT (buy to close) user %s %s qty=%.8f price=%.2f", uid, symbol, qty, price)
+                        _emit_trade(uid, user, symbol, "futures", "Buy", qty, price, timestamp, dry=True, action="close")
+                    else:
+                        res = c.place_futures_order("Buy", qty, symbol, leverage=cs.default_leverage, reduce_only=True)
+                        if log_info:
+                            logger.info("Futures close short res: %s", res)
+                        _emit_trade(uid, user, symbol, "futures", "Buy", qty, price, timestamp, dry=False, action="close", result=res)
+    except Exception:
+        logger.exception("Symbol loop error for user %s symbol %s", uid, symbol)
+
 # ----------------- main analysis and trade logic -----------------
 def analyze_and_trade_for_user(uid):
     users = load_users()
     if str(uid) not in users:
         return
     user = users[str(uid)]
-    _ensure_user_defaults(users, uid)
-    save_users(users)
+    if _ensure_user_defaults(users, uid):
+        save_users(users)
     settings = user["settings"]
     if settings.get("DISABLED_AUTH"):
         logger.info("User %s disabled auth, skip", uid)
@@ -563,8 +1578,14 @@ def analyze_and_trade_for_user(uid):
     if not api_key or not api_secret:
         logger.info("User %s missing api keys, skip", uid)
         return
-    testnet = bool(settings.get("TESTNET", True))
-    c = make_client(api_key, api_secret, testnet)
+    cs = compile_settings(settings)
+    # все индикаторы выключены (пауза) — цикл всё равно закончился бы
+    # active == 0 по каждому символу, но уже после OHLCV-запросов и чтения
+    # баланса; отсекаем до любого сетевого I/O
+    if not (cs.use_rsi or cs.use_ema or cs.use_macd or cs.use_oi):
+        logger.info("User %s has no indicators enabled, skip", uid)
+        return
+    c = _pooled_client(uid, api_key, api_secret, cs.testnet)
 
     # read balance
     bal = None
@@ -588,344 +1609,48 @@ def analyze_and_trade_for_user(uid):
     except Exception:
         balance_usd = 0.0
 
-    # symbols
-    raw_symbols = settings.get("SYMBOLS") or settings.get("symbols")
-    symbols = _normalize_symbols(raw_symbols) if raw_symbols is not None else _normalize_symbols(settings.get("SYMBOLS"))
-    if not symbols:
-        symbols = ["BTCUSDT"]
-    timeframe = settings.get("TIMEFRAME","5")
-    trade_mode = str(settings.get("TRADE_MODE","mixed")).lower()  # mixed / spot_only / futures_only
-
-    for symbol in symbols:
-        symbol = str(symbol).strip().upper()
-        try:
-            logger.info("User %s symbol %s fetching ohlcv", uid, symbol)
-            raw = None
-            if hasattr(c, "fetch_ohlcv"):
-                raw = c.fetch_ohlcv(symbol, interval=timeframe, limit=200)
-            else:
-                raw = None
-
-            preview = ""
-            if raw is None:
-                logger.warning("fetch_ohlcv returned None for %s %s", uid, symbol)
-            else:
-                try:
-                    preview = raw if isinstance(raw, str) else json.dumps(raw)[:800]
-                except Exception:
-                    preview = str(raw)[:800]
-                logger.info("fetch_ohlcv raw preview for %s %s: %s", uid, symbol, preview)
-
-            df = normalize_ohlcv(raw)
-            if df is None or (pd is not None and df.empty):
-                logger.warning("No ohlcv for %s %s (normalize returned None/empty). raw_preview=%s", uid, symbol, preview)
-                continue
-            close = df["close"]
-
-            # indicators & votes
-            votes = {"buy":0,"sell":0}
-            active = 0
-            indicators = {}
-
-            if settings.get("USE_RSI", True):
-                try:
-                    p = int(settings.get("RSI_PERIOD",14))
-                    r = rsi_series(close, period=p)
-                    lr = float(r.iloc[-1])
-                    indicators["rsi"]=lr
-                    if lr <= float(settings.get("RSI_OVERSOLD",40)):
-                        votes["buy"]+=1
-                    elif lr >= float(settings.get("RSI_OVERBOUGHT",60)):
-                        votes["sell"]+=1
-                    active+=1
-                except Exception:
-                    logger.exception("RSI fail")
-
-            if settings.get("USE_EMA", True):
-                try:
-                    f = int(settings.get("FAST_MA",50))
-                    s = int(settings.get("SLOW_MA",200))
-                    ef = ema_series(close, f)
-                    es = ema_series(close, s)
-                    lf = float(ef.iloc[-1])
-                    ls = float(es.iloc[-1])
-                    indicators["ema_fast"]=lf
-                    indicators["ema_slow"]=ls
-                    if lf > ls:
-                        votes["buy"]+=1
-                    else:
-                        votes["sell"]+=1
-                    active+=1
-                except Exception:
-                    logger.exception("EMA fail")
-
-            if settings.get("USE_MACD", True):
-                try:
-                    mf = int(settings.get("MACD_FAST",8))
-                    ms = int(settings.get("MACD_SLOW",21))
-                    sig = int(settings.get("MACD_SIGNAL",5))
-                    _,_,hist = macd_hist_series(close, fast=mf, slow=ms, signal=sig)
-                    hlast = float(hist.iloc[-1])
-                    indicators["macd_hist"]=hlast
-                    if hlast > 0:
-                        votes["buy"]+=1
-                    else:
-                        votes["sell"]+=1
-                    active+=1
-                except Exception:
-                    logger.exception("MACD fail")
-
-            if settings.get("USE_OI", False):
-                try:
-                    oi_raw = c.fetch_open_interest(symbol, interval=timeframe, limit=50) if hasattr(c, "fetch_open_interest") else None
-                    if oi_raw and isinstance(oi_raw, dict):
-                        res = oi_raw.get("result") or {}
-                        lst = res.get("list") or []
-                        if pd is not None and lst:
-                            srs = []
-                            for it in lst:
-                                val = it.get("open_interest") or it.get("oi") or it.get("openInterest")
-                                srs.append(float(val or 0))
-                            if len(srs) >= 2:
-                                pct = (srs[-1]-srs[0]) / max(srs[0],1e-9) * 100.0
-                                indicators["oi_pct"]=pct
-                                if pct >= float(settings.get("OI_MIN_CHANGE_PCT",5.0)):
-                                    votes["buy"]+=1
-                                elif pct <= -float(settings.get("OI_MIN_CHANGE_PCT",5.0)):
-                                    votes["sell"]+=1
-                                active+=1
-                except Exception:
-                    logger.exception("OI fail")
-
-            if active == 0:
-                logger.info("No active indicators for %s %s", uid, symbol)
-                continue
-
-            buy_ratio = votes["buy"]/active
-            sell_ratio = votes["sell"]/active
-            logger.info("User %s %s votes %s active %d buy_ratio %.2f sell_ratio %.2f", uid, symbol, votes, active, buy_ratio, sell_ratio)
-
-            buy_threshold = float(settings.get("BUY_CONFIRMATION_RATIO",0.66))
-            sell_threshold = float(settings.get("SELL_CONFIRMATION_RATIO",0.33))
-
-            # positions detection:
-            spot_pos = has_open_spot(uid, symbol)
-            short_pos = has_open_futures_short(uid, symbol)
-            long_pos = has_open_futures_long(uid, symbol)
-
-            price = float(close.iloc[-1])
-            timestamp = datetime.utcnow().isoformat()
-
-            # determine order USD size
-            def compute_order_usd():
-                order_usd = float(settings.get("ORDER_SIZE_USD",0.0) or 0.0)
-                if order_usd <= 0:
-                    return balance_usd * (float(settings.get("ORDER_PERCENT",10.0))/100.0)
-                return order_usd
-
-            # Helper to place futures order with long/short semantics depending on reduce_only flag
-            def place_futures_open(side, qty, lev):
-                if hasattr(c, "set_leverage"):
-                    try:
-                        c.set_leverage(symbol, lev)
-                    except Exception:
-                        logger.debug("set_leverage failed or not supported")
-                return c.place_futures_order(side, qty, symbol, leverage=lev, reduce_only=False)
-
-            def place_futures_close(side, qty, lev):
-                # close uses reduce_only True and side is the closing side (Buy to close short, Sell to close long)
-                return c.place_futures_order(side, qty, symbol, leverage=lev, reduce_only=True)
-
-            # ----------------- Trading behavior by TRADE_MODE -----------------
-            if trade_mode == "futures_only":
-                # Use futures for BOTH long and short
-                # BUY signal -> close short if exists else open long
-                if buy_ratio >= buy_threshold:
-                    order_usd = compute_order_usd()
-                    if order_usd <= 0:
-                        logger.warning("No capital for user %s", uid)
-                    else:
-                        qty = order_usd / price if price>0 else 0
-                        qty = floor_qty(qty, int(settings.get("QTY_PRECISION",6)))
-                        if qty * price < float(settings.get("MIN_NOTIONAL",5.0)):
-                            logger.warning("Order below min notional for %s", uid)
-                        else:
-                            lev = int(settings.get("DEFAULT_LEVERAGE",3))
-                            dry = bool(settings.get("DRY_RUN", False))
-                            if short_pos:
-                                # close short: buy reduce_only
-                                if dry:
-                                    logger.info("[DRY] FUTURES CLOSE SHORT (buy) user %s %s qty=%.8f price=%.2f", uid, symbol, qty, price)
-                                    tr = {"user_id": uid, "symbol": symbol, "market_type":"futures", "side":"Buy", "action":"close", "qty":qty, "price":price, "timestamp":timestamp, "dry":True}
-                                    append_trade(tr); notify_trade_to_user(user, tr)
-                                else:
-                                    res = place_futures_close("Buy", qty, lev)
-                                    logger.info("Futures close short res: %s", res)
-                                    tr = {"user_id": uid, "symbol": symbol, "market_type":"futures", "side":"Buy", "action":"close", "qty":qty, "price":price, "result":res, "timestamp":timestamp}
-                                    append_trade(tr); notify_trade_to_user(user, tr)
-                            else:
-                                # open long: buy open
-                                if dry:
-                                    logger.info("[DRY] FUTURES OPEN LONG (buy) user %s %s qty=%.8f price=%.2f lev=%d", uid, symbol, qty, price, lev)
-                                    tr = {"user_id": uid, "symbol": symbol, "market_type":"futures", "side":"Buy", "action":"open", "qty":qty, "price":price, "leverage":lev, "timestamp":timestamp, "dry":True}
-                                    append_trade(tr); notify_trade_to_user(user, tr)
-                                else:
-                                    res = place_futures_open("Buy", qty, lev)
-                                    logger.info("Futures open long res: %s", res)
-                                    tr = {"user_id": uid, "symbol": symbol, "market_type":"futures", "side":"Buy", "action":"open", "qty":qty, "price":price, "leverage":lev, "result":res, "timestamp":timestamp}
-                                    append_trade(tr); notify_trade_to_user(user, tr)
-
-                # SELL signal -> close long if exists else open short
-                if sell_ratio >= sell_threshold:
-                    order_usd = compute_order_usd()
-                    if order_usd <= 0:
-                        logger.warning("No capital for user %s", uid)
-                    else:
-                        qty = order_usd / price if price>0 else 0
-                        qty = floor_qty(qty, int(settings.get("QTY_PRECISION",6)))
-                        if qty * price < float(settings.get("MIN_NOTIONAL",5.0)):
-                            logger.warning("Order below min notional for %s", uid)
-                        else:
-                            lev = int(settings.get("DEFAULT_LEVERAGE",3))
-                            dry = bool(settings.get("DRY_RUN", False))
-                            if long_pos:
-                                # close long: sell reduce_only
-                                if dry:
-                                    logger.info("[DRY] FUTURES CLOSE LONG (sell) user %s %s qty=%.8f price=%.2f", uid, symbol, qty, price)
-                                    tr = {"user_id": uid, "symbol": symbol, "market_type":"futures", "side":"Sell", "action":"close", "qty":qty, "price":price, "timestamp":timestamp, "dry":True}
-                                    append_trade(tr); notify_trade_to_user(user, tr)
-                                else:
-                                    res = place_futures_close("Sell", qty, lev)
-                                    logger.info("Futures close long res: %s", res)
-                                    tr = {"user_id": uid, "symbol": symbol, "market_type":"futures", "side":"Sell", "action":"close", "qty":qty, "price":price, "result":res, "timestamp":timestamp}
-                                    append_trade(tr); notify_trade_to_user(user, tr)
-                            else:
-                                # open short: sell open
-                                if dry:
-                                    logger.info("[DRY] FUTURES OPEN SHORT user %s %s qty=%.8f price=%.2f lev=%d", uid, symbol, qty, price, lev)
-                                    tr = {"user_id": uid, "symbol": symbol, "market_type":"futures", "side":"Sell", "action":"open", "qty":qty, "price":price, "leverage":lev, "timestamp":timestamp, "dry":True}
-                                    append_trade(tr); notify_trade_to_user(user, tr)
-                                else:
-                                    if hasattr(c, "set_leverage"):
-                                        try:
-                                            c.set_leverage(symbol, lev)
-                                        except Exception:
-                                            logger.debug("set_leverage failed or not supported")
-                                    res = place_futures_open("Sell", qty, lev)
-                                    logger.info("Futures open short res: %s", res)
-                                    tr = {"user_id": uid, "symbol": symbol, "market_type":"futures", "side":"Sell", "action":"open", "qty":qty, "price":price, "leverage":lev, "result":res, "timestamp":timestamp}
-                                    append_trade(tr); notify_trade_to_user(user, tr)
-
-            else:
-                # MIXED or SPOT_ONLY behavior (existing logic)
-                # BUY -> spot buy (unless TRADE_MODE == spot_only then same); if you want buy via futures for mixed, change config
-                if buy_ratio >= buy_threshold and not spot_pos and trade_mode != "futures_only":
-                    order_usd = compute_order_usd()
-                    if order_usd <= 0:
-                        logger.warning("No capital for user %s", uid)
-                    else:
-                        qty = order_usd / price if price>0 else 0
-                        qty = floor_qty(qty, int(settings.get("QTY_PRECISION",6)))
-                        if qty * price < float(settings.get("MIN_NOTIONAL",5.0)):
-                            logger.warning("Order below min notional for %s", uid)
-                        else:
-                            dry = bool(settings.get("DRY_RUN", False))
-                            if dry:
-                                logger.info("[DRY] Spot BUY user %s %s qty=%.8f price=%.2f", uid, symbol, qty, price)
-                                tr = {"user_id": uid, "symbol": symbol, "market_type":"spot", "side":"Buy", "qty":qty, "price":price, "timestamp":timestamp, "dry":True}
-                                append_trade(tr); notify_trade_to_user(user, tr)
-                            else:
-                                if hasattr(c, "place_spot_order"):
-                                    res = c.place_spot_order("Buy", qty, symbol)
-                                else:
-                                    res = None
-                                logger.info("Spot buy result: %s", res)
-                                tr = {"user_id": uid, "symbol": symbol, "market_type":"spot", "side":"Buy", "qty":qty, "price":price, "result":res, "timestamp":timestamp}
-                                append_trade(tr); notify_trade_to_user(user, tr)
-
-                # CLOSE SPOT
-                if sell_ratio >= sell_threshold and spot_pos and trade_mode != "futures_only":
-                    qty = float(spot_pos.get("qty",0) or 0)
-                    if qty <= 0:
-                        logger.warning("Cannot determine spot qty to close for %s", uid)
-                    else:
-                        dry = bool(settings.get("DRY_RUN", False))
-                        if dry:
-                            logger.info("[DRY] Spot SELL (close) user %s %s qty=%.8f price=%.2f", uid, symbol, qty, price)
-                            tr = {"user_id": uid, "symbol": symbol, "market_type":"spot", "side":"Sell", "qty":qty, "price":price, "timestamp":timestamp, "dry":True}
-                            append_trade(tr); notify_trade_to_user(user, tr)
-                        else:
-                            res = c.place_spot_order("Sell", qty, symbol)
-                            logger.info("Spot sell result: %s", res)
-                            tr = {"user_id": uid, "symbol": symbol, "market_type":"spot", "side":"Sell", "qty":qty, "price":price, "result":res, "timestamp":timestamp}
-                            append_trade(tr); notify_trade_to_user(user, tr)
-
-                # SHORTS via futures (same as before)
-                if sell_ratio >= sell_threshold and settings.get("ENABLE_SHORTS", True) and not short_pos:
-                    order_usd = compute_order_usd()
-                    if order_usd <= 0:
-                        logger.warning("No capital for futures short user %s", uid)
-                    else:
-                        lev = int(settings.get("DEFAULT_LEVERAGE",3))
-                        qty = order_usd / price if price>0 else 0
-                        qty = floor_qty(qty, int(settings.get("QTY_PRECISION",6)))
-                        if qty * price < float(settings.get("MIN_NOTIONAL",5.0)):
-                            logger.warning("Futures order below min notional for %s", uid)
-                        else:
-                            dry = bool(settings.get("DRY_RUN", False))
-                            if dry:
-                                logger.info("[DRY] FUTURES OPEN SHORT user %s %s qty=%.8f price=%.2f lev=%d", uid, symbol, qty, price, lev)
-                                tr = {"user_id": uid, "symbol": symbol, "market_type":"futures", "side":"Sell", "action":"open", "qty":qty, "price":price, "leverage":lev, "timestamp":timestamp, "dry":True}
-                                append_trade(tr); notify_trade_to_user(user, tr)
-                            else:
-                                if hasattr(c, "set_leverage"):
-                                    try:
-                                        c.set_leverage(symbol, lev)
-                                    except Exception:
-                                        logger.debug("set_leverage failed or not supported")
-                                res = c.place_futures_order("Sell", qty, symbol, leverage=lev, reduce_only=False)
-                                logger.info("Futures open short res: %s", res)
-                                tr = {"user_id": uid, "symbol": symbol, "market_type":"futures", "side":"Sell", "action":"open", "qty":qty, "price":price, "leverage":lev, "result":res, "timestamp":timestamp}
-                                append_trade(tr); notify_trade_to_user(user, tr)
-
-                # CLOSE SHORT (buy to close)
-                if buy_ratio >= buy_threshold and short_pos:
-                    qty = float(short_pos.get("qty",0) or 0)
-                    if qty <= 0:
-                        logger.warning("Cannot determine futures qty to close for %s", uid)
-                    else:
-                        dry = bool(settings.get("DRY_RUN", False))
-                        if dry:
-                            logger.info("[DRY] FUTURES CLOSE SHORT (buy to close) user %s %s qty=%.8f price=%.2f", uid, symbol, qty, price)
-                            tr = {"user_id": uid, "symbol": symbol, "market_type":"futures", "side":"Buy", "action":"close", "qty":qty, "price":price, "timestamp":timestamp, "dry":True}
-                            append_trade(tr); notify_trade_to_user(user, tr)
-                        else:
-                            res = c.place_futures_order("Buy", qty, symbol, leverage=int(settings.get("DEFAULT_LEVERAGE",3)), reduce_only=True)
-                            logger.info("Futures close short res: %s", res)
-                            tr = {"user_id": uid, "symbol": symbol, "market_type":"futures", "side":"Buy", "action":"close", "qty":qty, "price":price, "result":res, "timestamp":timestamp}
-                            append_trade(tr); notify_trade_to_user(user, tr)
+    # symbols (нормализация уже сделана в compile_settings)
+    symbols = list(cs.symbols) or ["BTCUSDT"]
 
-        except Exception:
-            logger.exception("Symbol loop error for user %s symbol %s", uid, symbol)
+    # Работа на символ — это blocking HTTP + микросекунды CPU: фан-аут по
+    # потокам сжимает время пользователя с суммы RTT до максимума RTT
+    if len(symbols) <= 1:
+        for symbol in symbols:
+            _analyze_symbol(uid, user, cs, c, balance_usd, symbol)
+    else:
+        with ThreadPoolExecutor(max_workers=min(8, len(symbols))) as ex:
+            list(ex.map(
+                lambda s: _analyze_symbol(uid, user, cs, c, balance_usd, s),
+                symbols))
 
 def run_once():
     users = load_users()
     if not isinstance(users, dict):
         logger.error("users.json invalid")
         return
+    # один снимок ключей на оба прохода вместо двух list(users.keys())
+    uids = list(users)
     changed = False
-    for uid in list(users.keys()):
-        before = dict(users.get(uid, {}))
-        _ensure_user_defaults(users, uid)
-        if users.get(uid) != before:
+    for uid in uids:
+        if _ensure_user_defaults(users, uid):
             changed = True
     if changed:
         save_users(users)
-    for uid in list(users.keys()):
+    # пользователи независимы (свои ключи, свой клиент, свои символы), а
+    # работа — ожидание сети: фан-аут по потокам сжимает цикл с суммы
+    # пользовательских времён до максимума
+    def _safe_user(uid):
         try:
             analyze_and_trade_for_user(uid)
         except Exception:
             logger.exception("User loop error for %s", uid)
+    if len(uids) <= 1:
+        for uid in uids:
+            _safe_user(uid)
+    else:
+        max_workers = min(int(os.getenv("MAX_USER_WORKERS", "8")), len(uids))
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            list(ex.map(_safe_user, uids))
 
 # CLI diag
 def diag(uid):
@@ -949,13 +1674,40 @@ def diag(uid):
             r = c.fetch_ohlcv("BTCUSDT", interval=str(s.get("TIMEFRAME","5")), limit=5)
             print("KLINE preview type:", type(r))
             try:
-                import json as _j
-                print("KLINE preview:", _j.dumps(r)[:800])
+                # не сериализуем мегабайтный ответ ради 800 символов —
+                # человеку хватит первых строк
+                preview = r[:3] if isinstance(r, list) else r
+                if isinstance(r, dict) and isinstance((r.get("result") or {}).get("list"), list):
+                    preview = dict(r, result=dict(r["result"], list=r["result"]["list"][:3]))
+                print("KLINE preview:", _dumps_compact(preview)[:800])
             except Exception:
                 print("KLINE preview (raw):", str(r)[:800])
     except Exception as e:
         print("Diag client error:", e)
 
+def loop(interval_sec=60):
+    """Бесконечный цикл run_once с заданным интервалом.
+    Вызывается и из CLI (loop-режим), и из main.py in-process."""
+    _ensure_files()
+    logger.info("Starting loop mode: interval %s sec", interval_sec)
+    # дедлайны по monotonic-часам: sleep(sec) после run_once давал период
+    # sec + длительность цикла и накапливал дрейф; теперь тики выровнены,
+    # а перерасход цикла виден в логе
+    sec = max(1, interval_sec)
+    next_t = time.monotonic()
+    while True:
+        try:
+            run_once()
+        except Exception:
+            logger.exception("run_once crashed")
+        next_t += sec
+        sleep_for = next_t - time.monotonic()
+        if sleep_for < 0:
+            logger.warning("Cycle overran by %.2fs", -sleep_for)
+            next_t = time.monotonic()  # ресинк, не догоняем пропущенные тики
+        else:
+            time.sleep(sleep_for)
+
 if __name__ == "__main__":
     _ensure_files()
     if len(sys.argv)>=2 and sys.argv[1]=="diag":
@@ -971,13 +1723,7 @@ if __name__ == "__main__":
                 sec=int(sys.argv[2])
         except:
             pass
-        logger.info("Starting loop mode: interval %s sec", sec)
-        while True:
-            try:
-                run_once()
-            except Exception:
-                logger.exception("run_once crashed")
-            time.sleep(max(1, sec))
+        loop(sec)
     else:
         run_once()
         logger.info("Run complete.")